@@ -7,7 +7,14 @@ from collections import OrderedDict, defaultdict
 from portfolio import Portfolio
 import random
 
-from wavelet import lowpassfilter
+from ranking import kth_largest
+from rolling import RollingWindow
+from wavelet import lowpassfilter_batch
+from indicators import EMA, SMA, RollingStd, TrendSlope, array_market, market_field, previous, series, window_trend
+
+# Action codes for agents that decide on arrays
+HOLD, BUY, SELL = 0, 1, -1
+ACTION_NAMES = {BUY: "BUY", SELL: "SELL"}
 
 class Decision:
     """
@@ -17,9 +24,9 @@ class Decision:
         condition: str on how the variables are put together
     """
 
-    def __init__(self, result=None, variables={}, condition=""):
+    def __init__(self, result=None, variables=None, condition=""):
         self.result = result
-        self.variables = variables
+        self.variables = {} if (variables == None) else variables
         self.condition = condition
 
     def __repr__(self):
@@ -31,6 +38,74 @@ class Decision:
         else:
             return False
 
+class Decisions:
+    """
+    Decisions of one tick as arrays instead of a Decision per stock
+        symbols: stocks the rows are for
+        actions: int8 BUY, SELL or HOLD for each symbol
+        variables: (symbols x len(names)) decision variables or None
+        names: names of the decision variables, the same every tick
+    len() is the number of BUY and SELL decisions
+    """
+
+    def __init__(self, symbols, actions, variables=None, names=()):
+        self.symbols = symbols
+        self.actions = actions
+        self.variables = variables
+        self.names = names
+
+    def __len__(self):
+        return int(np.count_nonzero(self.actions))
+
+    def __repr__(self):
+        return f"Decisions({dict(self.items())})"
+
+    def rows(self):
+        """ Rows with a BUY or SELL
+        """
+        return np.flatnonzero(self.actions)
+
+    def items(self):
+        """ (stock, "BUY" or "SELL") of every decision made
+        """
+        for i in self.rows():
+            yield self.symbols[i], ACTION_NAMES[self.actions[i]]
+
+    def get(self, stock):
+        """ Decision for stock, for looking at one at a time
+        """
+        if stock not in self.symbols:
+            return Decision()
+        i = list(self.symbols).index(stock)
+        var_dict = {}
+        if (self.variables is not None):
+            var_dict = dict(zip(self.names, self.variables[i].tolist()))
+        return Decision(ACTION_NAMES.get(self.actions[i]), var_dict)
+
+def no_decisions():
+    return Decisions([], np.zeros(0, dtype=np.int8))
+
+class Signals:
+    """
+    Decisions for every tick of a backtest worked out up front
+        symbols: stocks the columns are for
+        actions: (time x symbol) int8 of BUY, SELL or HOLD
+        variables: (time x symbol x len(names)) decision variables or None
+        names: names of the decision variables
+    """
+
+    def __init__(self, symbols, actions, variables=None, names=()):
+        self.symbols = symbols
+        self.actions = actions
+        self.variables = variables
+        self.names = names
+
+    def decisions(self, t):
+        """ Decisions at tick t, views into the signal arrays
+        """
+        variables = None if (self.variables is None) else self.variables[t]
+        return Decisions(self.symbols, self.actions[t], variables, self.names)
+
 class AgentMeanReversion:
     """
     Calculate the moving average of a stock.
@@ -39,57 +114,86 @@ class AgentMeanReversion:
 
     if current price is above we can sell
     if below we should maybe buy
+
+    The average, standard deviation and trend cover the last
+    trend_modifier*avg_range prices. They are streaming indicators
+    updated for all stocks at once, so a tick costs the same whatever
+    the window length.
     """
-    def __init__(self, stocks, avg_range=10, trend_modifier=3):
+    variable_names = ("moving_avg", "std", "trend_percent")
+
+    def __init__(self, stocks, avg_range=10, trend_modifier=3, resync_every=10000):
         self.stocks = stocks
         self.avg_range = avg_range
-        self.history = {stock:np.array([]) for stock in self.stocks}
-        self.long_trend = {stock:np.array([]) for stock in self.stocks}
         self.trend_modifier = trend_modifier
+        self.resync_every = resync_every
+        self.window_size = self.trend_modifier*self.avg_range
+        self.half = self.window_size // 2
+        self.std = RollingStd(self.window_size, resync_every=resync_every)
+        self.trend = TrendSlope(self.window_size, self.half, resync_every=resync_every)
+        self.std.start(len(self.stocks))
+        self.trend.start(len(self.stocks))
+
+    def update(self, close):
+        """
+        Add one tick of close prices, ordered like self.stocks and NaN
+        where a stock has no price. Decisions use the window before
+        this tick's price is added.
+
+        Returns:
+            int8 array of BUY, SELL or HOLD and a (stocks x 3) array of
+            moving_avg, std and trend_percent (NaN until the window is full)
+        """
+        full = ~np.isnan(close) & self.std.full
+        variables = np.column_stack([self.std.mean, self.std.value, self.trend.value])
+        variables[~full] = np.nan
+        moving_avg, std, trend_percent = variables.T
+
+        actions = np.zeros(len(self.stocks), dtype=np.int8)
+        actions[full & (close > moving_avg + std) & (trend_percent < 0)] = SELL
+        actions[full & (actions == HOLD) & (close < moving_avg - std)] = BUY
+
+        self.std.update(close)
+        self.trend.update(close)
+        return actions, variables
+
+    def clear(self):
+        pass
+
+    def compute_signals(self, market):
+        """
+        Decisions for every tick of the market at once, the same as calling
+        decide on every tick. Each tick only uses the window of prices
+        before it, so there is no look ahead.
+
+        Returns:
+            Signals with moving_avg, std and trend_percent variables
+        """
+        market = array_market(market)
+        n = self.window_size
+        closes = market_field(market, self.stocks)
+        valid = ~np.isnan(closes)
+        moving_avg = previous(series(market, self.stocks, SMA(n)), valid)
+        std = previous(series(market, self.stocks, RollingStd(n)), valid)
+        trend_percent = previous(series(market, self.stocks, TrendSlope(n, self.half)), valid)
+        full = ~np.isnan(moving_avg)
+
+        actions = np.zeros(closes.shape, dtype=np.int8)
+        sell = full & (closes > moving_avg + std) & (trend_percent < 0)
+        actions[sell] = SELL
+        actions[full & ~sell & (closes < moving_avg - std)] = BUY
+        variables = np.stack([moving_avg, std, trend_percent], axis=2)
+        return Signals(self.stocks, actions, variables, self.variable_names)
 
     def decide(self, data):
         """
         Given new data and current state
         make a decision to buy or sell.
         """
-        decisions = {stock: Decision() for stock in self.stocks}
-
-        for stock in self.stocks:
-            stock_price = data.get(stock)
-            if (stock_price == None):
-                continue
-
-            stock_price = stock_price['close']
-            # Wait for enough data
-            if (len(self.long_trend[stock]) < self.trend_modifier*self.avg_range):
-                tmp = np.append(self.long_trend[stock], stock_price)
-                self.long_trend[stock] = tmp
-                tmp = np.append(self.history[stock], stock_price)
-                self.history[stock] = tmp
-            else:
-                moving_avg = np.mean(self.history[stock])
-                trend_len = len(self.long_trend[stock])
-                long_trend_start = np.mean(self.long_trend[stock][:trend_len//2])
-                long_trend_end   = np.mean(self.long_trend[stock][trend_len//2:])
-                trend = long_trend_end - long_trend_start
-                trend_percent = (trend / long_trend_end)
-                std = np.std(self.history[stock])
-                var_dict = {"moving_avg":moving_avg, "std":std, "trend_percent": trend_percent}
-
-                if ((stock_price > moving_avg + 1*std) and (trend_percent < 0)):
-                    decisions[stock] = Decision("SELL", var_dict, "moving_ave + std and trend_percent > 0")
-                elif ((stock_price < moving_avg - 1*std)):# and (trend_percent > 0)):
-                    decisions[stock] = Decision("BUY", var_dict, "moving_ave - std")
-
-                self.history[stock] = self.history[stock][1:]
-                tmp = np.append(self.history[stock], stock_price)
-                self.history[stock] = tmp
-
-                self.long_trend[stock] = self.long_trend[stock][1:]
-                tmp = np.append(self.long_trend[stock], stock_price)
-                self.long_trend[stock] = tmp
-
-        return decisions
+        close = np.array([np.nan if data.get(stock) == None else data[stock]['close'] for stock in self.stocks],
+                         dtype=np.float64)
+        actions, variables = self.update(close)
+        return Decisions(self.stocks, actions, variables, self.variable_names)
 
 class AgentWaveTrend:
     """
@@ -98,93 +202,94 @@ class AgentWaveTrend:
     trend is average of last half - average last half
     then scaled by last half so they are comparable
     The stocks are sorted then filtered by a minimim volume size.
-    only the top stock is returned with a BUY decision
+    only the stock at selection_index (0 is the best) among those with
+    average volume above min_volume is returned with a BUY decision
+
+    Windows of every stock are filtered together in one batched wavelet
+    transform and trends are kept as arrays in the order of history.symbols
     """
-    def __init__(self, stocks, window_size=20, wavelet_type='db4', value_threshold=0.63):
+    variable_names = ("trend",)
+
+    def __init__(self, stocks, window_size=20, wavelet_type='db4', value_threshold=0.63,
+                 selection_index=20, min_volume=0):
         self.stocks = stocks
+        self.selection_index = selection_index
+        self.min_volume = min_volume
         self.window_size = window_size
         self.wavelet_type = wavelet_type
         self.value_threshold = value_threshold
-        self.history = {} #stock:np.array([]) for stock in self.stocks}
-        self.history_vol = {} #stock:np.array([]) for stock in self.stocks}
-        self.trends = {}
-        self.ave_vol = {}
+        self.history = RollingWindow(self.window_size)
+        self.history_vol = RollingWindow(self.window_size)
+        # NaN until a stock has a full window
+        self.trends = np.array([])
+        self.ave_vol = np.array([])
 
     def clear(self):
         """
         Option to restart on new day
         """
-        self.history = {} #stock:np.array([]) for stock in self.stocks}
-        self.trends = {}
+        self.history.clear()
+        self.history_vol.clear()
+        self.trends[:] = np.nan
 
+    def rows(self, stocks):
+        """ Rows of stocks in the windows and trend arrays
+        """
+        rows = np.array([self.history.row(stock) for stock in stocks], dtype=np.int64)
+        for stock in self.history.symbols[len(self.history_vol):]:
+            self.history_vol.add(stock)
+        extra = len(self.history) - len(self.trends)
+        if (extra > 0):
+            self.trends = np.append(self.trends, np.full(extra, np.nan))
+            self.ave_vol = np.append(self.ave_vol, np.full(extra, np.nan))
+        return rows
+
+    def update(self, rows, close, volume):
+        """
+        Add one tick of prices for rows. Stocks with a full window
+        get their trend from the window before this price is added.
+        """
+        full = self.history.count[rows] == self.window_size
+        full_rows = rows[full]
+        if len(full_rows) > 0:
+            filtered_price = lowpassfilter_batch(self.history.windows(full_rows), wavelet=self.wavelet_type,
+                                                 threshold=self.value_threshold)
+            self.trends[full_rows] = window_trend(filtered_price)
+            self.ave_vol[full_rows] = np.mean(self.history_vol.windows(full_rows), axis=1)
+
+        # Volume is only collected while the window fills
+        self.history_vol.push_rows(rows[~full], volume[~full])
+        self.history.push_rows(rows, close)
 
     def decide(self, data):
         """
         Given new data and current state
         make a decision to buy or sell.
         """
-        decisions = {}
+        stocks = [stock for stock, stock_price in data.items() if stock_price != None]
+        rows = self.rows(stocks)
+        close = np.array([data[stock]['close'] for stock in stocks], dtype=np.float64)
+        volume = np.array([data[stock]['volume'] for stock in stocks], dtype=np.float64)
+        self.update(rows, close, volume)
 
-        for stock in data.keys():# self.stocks:
-
-            if (not isinstance(self.history.get(stock), np.ndarray)):
-                self.history[stock] = np.array([])
-                self.history_vol[stock] = np.array([])
-            stock_price = data.get(stock)
-            if (stock_price == None):
-                continue
-
-            stock_vol = stock_price['volume']
-            stock_price = stock_price['close']
-            # Wait for enough data
-
-            if (len(self.history[stock]) < self.window_size):
-                tmp = np.append(self.history_vol[stock], stock_vol)
-                self.history_vol[stock] = tmp
-
-                tmp = np.append(self.history[stock], stock_price)
-                self.history[stock] = tmp
-
-            else:
-                filtered_price = lowpassfilter(self.history[stock], wavelet=self.wavelet_type, threshold=self.value_threshold)
-                f_len = len(filtered_price)
-                low_ave  = np.mean(filtered_price[:f_len//2])
-                high_ave = np.mean(filtered_price[f_len//2:])
-                trend = high_ave - low_ave
-                trend = trend / high_ave
-                var_dict = {"trend":trend}
-
-                # Save trend for all stocks
-                self.trends[stock] = trend
-                self.ave_vol[stock] = np.mean(self.history_vol[stock])
-
-#                if (trend > 0.1):
-#                    decisions[stock] = Decision("BUY", var_dict, "trend > 0")
-#                elif (trend < 0):
-#                    decisions[stock] = Decision("SELL", var_dict, "trend < 0")
-
-                self.history[stock] = self.history[stock][1:]
-                tmp = np.append(self.history[stock], stock_price)
-                self.history[stock] = tmp
-
-        if (len(self.trends) > 0):
-            top = sorted(self.trends, key=lambda x: self.trends[x], reverse=True)
-            best = list(filter(lambda x: self.ave_vol[x] > 0, top))
-            selection_index = 20
-            print(best[selection_index])
-            print(self.trends[best[selection_index]])
-            print(self.ave_vol[best[selection_index]])
-            decisions[best[selection_index]] = Decision("BUY")
-
-        return decisions
+        choice = kth_largest(self.trends, self.selection_index, mask=self.ave_vol > self.min_volume)
+        if (choice == None):
+            return no_decisions()
+        return Decisions([self.history.symbols[choice]], np.array([BUY], dtype=np.int8),
+                         self.trends[[choice], None], self.variable_names)
 
 
 class AgentRandom:
     """
-    Pick a single stock every day to buy and hold
+    Pick a single stock every day to buy and hold.
+    Each agent draws from its own random stream, the same picks
+    every time for the same seed
     """
-    def __init__(self, stocks):
+    variable_names = ()
+
+    def __init__(self, stocks, seed=None):
         self.stocks = stocks
+        self.random = np.random.default_rng(seed)
 
     def clear(self):
         pass
@@ -194,106 +299,136 @@ class AgentRandom:
         Given new data and current state
         make a decision to buy or sell.
         """
-
-        decisions = {}
-        choice = random.choice(list(data.keys()))
-        decisions[choice] = Decision("BUY")
-        return decisions
+        stocks = list(data.keys())
+        # One draw every tick so compute_signals gets the same stream
+        draw = self.random.random()
+        if (len(stocks) == 0):
+            return no_decisions()
+        choice = stocks[int(draw * len(stocks))]
+        return Decisions([choice], np.array([BUY], dtype=np.int8))
+
+    def compute_signals(self, market):
+        """
+        Picks for every tick at once, the same as calling decide on every
+        tick of a StockMarketArray with an agent of the same seed
+        """
+        market = array_market(market)
+        has_data = ~np.isnan(market.prices).all(axis=2)
+        draws = self.random.random(len(market.dates))
+        pick = (draws * has_data.sum(axis=1)).astype(np.int64)
+        position = np.cumsum(has_data, axis=1) - 1
+        chosen = has_data & (position == pick[:, None])
+        return Signals(market.symbols, np.where(chosen, BUY, HOLD).astype(np.int8))
 
 
 class AgentMACD:
     """
     Trade on MACD crosses
+
+    mac1 (slow) and mac2 (fast) are exponential moving averages of the close
+    with smoothing 2/(n+1). macd = mac2 - mac1 and the signal line is an
+    EMA of macd over macd_num. All stocks are updated together as vectors
+    so each tick costs about the same for 500 stocks as for one.
+    BUY while macd is above the signal line, SELL while below.
     """
-    def __init__(self, stocks, mac1_num=12, mac2_num=26, macd_num=9, beta=0.9):
-        self.stocks = stocks
-        self.beta = beta
-        self.MAC = {stock: np.array([]) for stock in self.stocks}
-        self.MACD = {stock: np.array([]) for stock in self.stocks}
+    variable_names = ("mac1", "mac2", "macd")
 
+    def __init__(self, stocks, mac1_num=12, mac2_num=26, macd_num=9):
+        self.stocks = stocks
         self.mac1_num = max(mac1_num, mac2_num)
         self.mac2_num = min(mac1_num, mac2_num)
         self.macd_num = macd_num
-        self.beta_array = np.zeros(self.mac1_num)
-        self._init_beta()
-
-    def _init_beta(self):
-        """ Weights for EMA
-        """
-        self.beta_array[0] = 1 #self.beta
-        for i in range(1, self.mac1_num):
-            self.beta_array[i] = 1 #(1-self.beta) * self.beta_array[i-1]
+        self.ema1 = EMA(self.mac1_num)
+        self.ema2 = EMA(self.mac2_num)
+        self.ema_signal = EMA(self.macd_num)
+        for ema in [self.ema1, self.ema2, self.ema_signal]:
+            ema.start(len(self.stocks))
 
-    def mac1(self, stock):
-        x = np.average(self.MAC[stock][::-1][:self.mac1_num],  weights=self.beta_array[:self.mac1_num])
-        return x
+    @property
+    def mac1(self):
+        return self.ema1.value
 
-    def mac2(self, stock):
-        x = np.average(self.MAC[stock][::-1][:self.mac2_num],  weights=self.beta_array[:self.mac2_num])
-        return x
+    @property
+    def mac2(self):
+        return self.ema2.value
 
-    def macd(self, stock):
-        return np.average(self.MACD[stock][::-1][:self.mac1_num],  weights=self.beta_array[:self.macd_num])
+    @property
+    def signal(self):
+        return self.ema_signal.value
 
-    def decide(self, data):
-        """ Given new data and current state
-        make a decision to buy or sell.
+    @property
+    def count(self):
+        """ Number of prices seen by each stock
         """
-        decisions = {stock: Decision() for stock in self.stocks}
-        for stock in self.stocks:
-            stock_price = data.get(stock)
-            decisions[stock] = Decision()
-            if (stock_price == None):
-                continue
-            # Wait for enough data
+        return self.ema1.count
 
-            stock_price = stock_price['close']
-
-            # Need a EMA of the MACD values
-            if (len(self.MACD[stock]) < self.macd_num):
-
-                # Fill bigger one if not filled
-                if (len(self.MAC[stock]) < self.mac1_num):
-                    tmp = np.append(self.MAC[stock], stock_price)
-                    self.MAC[stock] = tmp
-
-                # if bigger one filled can compute macd
-                else:
-                    # Update mac values to include newest
-                    self.MAC[stock] = self.MAC[stock][1:]
-                    tmp = np.append(self.MAC[stock], stock_price)
-                    self.MAC[stock] = tmp
-
-                    macd = self.mac2(stock) - self.mac1(stock)
-                    tmp = np.append(self.MACD[stock], macd)
-                    self.MACD[stock] = tmp
+    @property
+    def macd(self):
+        return self.mac2 - self.mac1
 
-            # If MACD is filled can compute a decision
-            else:
+    def update(self, close):
+        """
+        Add one tick of close prices, ordered like self.stocks and NaN
+        where a stock has no price.
 
-                # Need to track history of neg and pos to see when cross
-                # For only trading 1 stock at a time this works without
-                # having to store history
-                self.MAC[stock] = self.MAC[stock][1:]
-                tmp = np.append(self.MAC[stock], stock_price)
-                self.MAC[stock] = tmp
+        Returns:
+            int8 array of BUY, SELL or HOLD for each stock
+        """
+        valid = ~np.isnan(close)
+        self.ema1.update(close)
+        self.ema2.update(close)
 
-                macd = self.mac2(stock) - self.mac1(stock)
+        # Signal line starts once the slow average has seen mac1_num prices
+        macd = self.macd
+        self.ema_signal.update(np.where(valid & (self.count >= self.mac1_num), macd, np.nan))
 
-                self.MACD[stock] = self.MACD[stock][1:]
-                tmp = np.append(self.MACD[stock], macd)
-                self.MACD[stock] = tmp
+        ready = valid & (self.count >= self.mac1_num + self.macd_num)
+        diff = macd - self.signal
+        actions = np.zeros(len(self.stocks), dtype=np.int8)
+        actions[ready & (diff > 0)] = BUY
+        actions[ready & (diff < 0)] = SELL
+        return actions
 
-                signal = macd - self.macd(stock)
+    def clear(self):
+        pass
 
-                var_dict = {"mac1":self.mac1(stock), "mac2": self.mac2(stock), "macd": self.macd(stock)}
+    def compute_signals(self, market):
+        """
+        Decisions for every tick of the market at once, the same as calling
+        decide on every tick. The averages run forward in time over each
+        stock's own prices so there is no look ahead.
 
-                if (signal < 0):
-                    decisions[stock] = Decision("SELL", var_dict, "macd < 0")
-                elif (signal > 0):
-                    decisions[stock] = Decision("BUY", var_dict, "macd > 0")
+        Returns:
+            Signals with mac1, mac2 and macd (the signal line) variables
+        """
+        market = array_market(market)
+        closes = market_field(market, self.stocks)
+        valid = ~np.isnan(closes)
+        count = np.cumsum(valid, axis=0)
+
+        mac1 = series(market, self.stocks, EMA(self.mac1_num))
+        mac2 = series(market, self.stocks, EMA(self.mac2_num))
+        macd = mac2 - mac1
+        signal = EMA(self.macd_num).compute(np.where(valid & (count >= self.mac1_num), macd, np.nan))
+
+        ready = valid & (count >= self.mac1_num + self.macd_num)
+        diff = macd - signal
+        actions = np.zeros(closes.shape, dtype=np.int8)
+        actions[ready & (diff > 0)] = BUY
+        actions[ready & (diff < 0)] = SELL
+        variables = np.stack([mac1, mac2, signal], axis=2)
+        variables[~ready] = np.nan
+        return Signals(self.stocks, actions, variables, self.variable_names)
 
-        return decisions
+    def decide(self, data):
+        """ Given new data and current state
+        make a decision to buy or sell.
+        """
+        close = np.array([np.nan if data.get(stock) == None else data[stock]['close'] for stock in self.stocks],
+                         dtype=np.float64)
+        actions = self.update(close)
+        variables = np.column_stack([self.mac1, self.mac2, self.signal])
+        return Decisions(self.stocks, actions, variables, self.variable_names)
 
 class RandomAgent:
     """
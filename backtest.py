@@ -0,0 +1,176 @@
+"""
+Vectorized backtests. Plays the same rules as main.Executor over a whole
+signal matrix (agent.compute_signals) at once instead of tick by tick:
+    Orders are put in on the tick of a decision and filled at the next
+    tick's open price, buys first then sells.
+    Only the first tick of a session with a BUY or SELL is acted on.
+    At close_time pending buys are dropped and everything held is sold
+    on the next tick.
+    A stock is bought one share at a time, only if not already held
+    and its price is less than the cash left.
+The ticks that are acted on are found with array operations and only
+they and the fills after them are stepped through, so the cost grows with
+the number of trades rather than the number of ticks. Positions, cash,
+value and gain come out as arrays over every tick.
+
+Portfolio values are worked out the way Portfolio.total_value does it,
+cash + cost of stocks held, or cash + the latest open price of the stocks
+held with mark_to_market.
+"""
+import numpy as np
+import pandas as pd
+
+from indicators import market_field
+from metrics import drawdown, summary
+from utils import seconds_of_day
+
+# Ledger of round trips. Still open trades have sell_tick -1 and sell_price NaN
+TRADE = np.dtype([("symbol", np.int32), ("buy_tick", np.int64), ("buy_price", np.float64),
+                  ("sell_tick", np.int64), ("sell_price", np.float64)])
+
+def _session_cumsum(x, session, first):
+    """ Running sum of x within each session
+    """
+    total = np.cumsum(x)
+    before = total - x
+    return total - before[first][session]
+
+def sessions(session_date):
+    """
+    Session number of every tick and the indexes of the first tick of
+    each session, from market.session_date
+    """
+    days = np.asarray(session_date)
+    starts = np.concatenate([[True], days[1:] != days[:-1]])
+    return np.cumsum(starts) - 1, np.flatnonzero(starts)
+
+class Backtest:
+    """
+    Results of a vectorized backtest, arrays over market.dates
+        positions: (time x symbol) shares held after each tick's fills
+        cash, equity (cost of stocks held), realized, value, gain: (time,)
+        market_value: latest prices of the stocks held, None unless mark to market
+        tracked: ticks Executor would put in value_tracker
+        trades: TRADE records in the order they were bought
+        times: seconds since epoch of each tick
+    """
+
+    def __init__(self, dates, symbols, initial_cash, positions, cash, equity, realized, tracked, trades, times,
+                 market_value=None):
+        self.dates = dates
+        self.times = times
+        self.symbols = symbols
+        self.initial_cash = initial_cash
+        self.positions = positions
+        self.cash = cash
+        self.equity = equity
+        self.realized = realized
+        self.market_value = market_value
+        self.value = cash + (equity if (market_value is None) else market_value)
+        self.gain = 100*(self.value - initial_cash) / initial_cash
+        self.tracked = tracked
+        self.trades = trades
+        self.max_height, self.max_time = drawdown(self.value[tracked], times[tracked])
+
+    @property
+    def value_tracker(self):
+        """ {day: gain} of the tracked ticks like Executor.value_tracker
+        """
+        ticks = np.flatnonzero(self.tracked)
+        return dict(zip([self.dates[t] for t in ticks], self.gain[ticks].tolist()))
+
+    def metrics(self, periods_per_year=252, risk_free=0.0):
+        """ metrics.summary of the tracked values, like Executor.metrics.summary()
+        """
+        sold = self.trades[self.trades["sell_tick"] >= 0]
+        traded = np.concatenate([self.trades["buy_price"], sold["sell_price"]])
+        return summary(self.value[self.tracked], self.times[self.tracked], sold["sell_price"] - sold["buy_price"],
+                       traded, periods_per_year, risk_free)
+
+def run_backtest(signals, market, cash=10000, close_time="18:30:00", mark_to_market=False):
+    """
+    Backtest signals (an agent.Signals) against the open prices of market,
+    a StockMarketArray. Random prices are not supported.
+    mark_to_market values holdings like Portfolio(mark_to_market=True)
+
+    Returns:
+        Backtest
+    """
+    assert not getattr(market, "random_price", False), "Vectorized backtests use open prices"
+    dates = market.dates
+    n_ticks, n_symbols = signals.actions.shape
+    assert n_ticks == len(dates), "Signals must cover every date of the market"
+    opens = market_field(market, signals.symbols, "open")
+
+    # Which ticks are acted on. Everything here only depends on the signals
+    session, first = sessions(market.session_date)
+    first_of_session = np.zeros(n_ticks, dtype=bool)
+    first_of_session[first] = True
+    at_close = market.time_of_day == seconds_of_day(close_time)
+    # Closing on the first tick of a session is undone by the new day
+    closing = at_close & ~first_of_session
+    closed = _session_cumsum(closing, session, first) > 0
+    candidate = signals.actions.any(axis=1) & ~closed
+    acted_before = _session_cumsum(candidate, session, first) - candidate
+    acting = candidate & (acted_before == 0)
+    tracked = ~closed & (acted_before == 0)
+
+    events = acting | at_close
+    events[1:] |= acting[:-1] | closing[:-1]
+
+    held = np.zeros(n_symbols, dtype=bool)
+    # Buy tick and price of every open trade, in the order bought
+    open_trades = {}
+    trades = []
+    flows = np.zeros((n_ticks, 3))
+    fills = []
+    buys, sells = [], []
+    balance = cash
+    for t in np.flatnonzero(events):
+        if (at_close[t]):
+            buys = []
+
+        for s in buys:
+            price = opens[t, s]
+            if (price == price) and (price < balance):
+                balance -= price
+                held[s] = True
+                open_trades[s] = (t, price)
+                flows[t] += (-price, price, 0)
+                fills.append((t, s, 1))
+        for s in sells:
+            price = opens[t, s]
+            if held[s] and (price == price):
+                balance += price
+                held[s] = False
+                buy_tick, buy_price = open_trades.pop(s)
+                trades.append((s, buy_tick, buy_price, t, price))
+                flows[t] += (price, -buy_price, price - buy_price)
+                fills.append((t, s, -1))
+        buys, sells = [], []
+
+        if (tracked[t]):
+            actions = signals.actions[t]
+            buys = [s for s in np.flatnonzero(actions > 0) if not held[s]]
+            sells = list(np.flatnonzero(actions < 0))
+        elif (closing[t]):
+            sells = list(open_trades.keys())
+
+    for s, (buy_tick, buy_price) in open_trades.items():
+        trades.append((s, buy_tick, buy_price, -1, np.nan))
+    trades = np.array(trades, dtype=TRADE)
+    trades = trades[np.argsort(trades["buy_tick"], kind="stable")]
+
+    positions = np.zeros((n_ticks, n_symbols), dtype=np.int64)
+    if (len(fills) > 0):
+        fills = np.array(fills, dtype=np.int64)
+        np.add.at(positions, (fills[:, 0], fills[:, 1]), fills[:, 2])
+    positions = np.cumsum(positions, axis=0)
+    running = np.cumsum(flows, axis=0)
+    market_value = None
+    if (mark_to_market):
+        # Stocks without a price keep their last one, there always is one since they were bought
+        latest = pd.DataFrame(opens).ffill().to_numpy()
+        market_value = np.where(positions > 0, positions * latest, 0).sum(axis=1)
+    return Backtest(dates, signals.symbols, cash, positions, cash + running[:, 0], running[:, 1],
+                    running[:, 2], tracked, trades, market.times, market_value)
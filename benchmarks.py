@@ -0,0 +1,439 @@
+"""
+Timing and memory comparisons between the different backends.
+Run from the repo root, e.g.
+    python benchmarks.py
+"""
+import gc
+import os
+import pickle
+import random
+import shutil
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from rolling import RollingWindow
+from agent import AgentMACD, AgentMeanReversion, Decision
+from checkpoint import Checkpoint
+from main import Executor
+from parity import check_backtest_parity
+from trackers import DecisionTracker, PortfolioTracker
+from portfolio import Holding, Portfolio
+import indicators
+import metrics
+from utils import convert_date, seconds_of_day, split_datetime_str
+from market import StockMarketDict, StockMarketArray, StockMarketDataFrame
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _traced(func, *args, **kwargs):
+    """ Returns result, seconds taken and bytes still held afterwards
+    """
+    gc.collect()
+    tracemalloc.start()
+    result, seconds = _timed(func, *args, **kwargs)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, current
+
+def bench_market_backends(data_file="./data/intraday_datetimes_1min.pkl", stocks=["AMZN"], lookups=100000):
+    """
+    Compare StockMarketDict with StockMarketArray on
+    load time, memory held and buy/sell/snapshot lookups
+    """
+    results = {}
+    markets = {}
+    for name, backend in [("dict", StockMarketDict), ("array", StockMarketArray)]:
+        market, load_time, memory = _traced(backend, stocks=stocks, data_file=data_file)
+        markets[name] = market
+        results[name] = {"load_s": load_time, "memory_mb": memory / 1e6}
+
+    dates = markets["dict"].dates
+    queries = [(random.choice(stocks), random.choice(dates)) for _ in range(lookups)]
+    snapshot_dates = dates[:min(len(dates), 1000)]
+
+    for name, market in markets.items():
+        _, buy_time = _timed(lambda: [market.buy(s, d) for s, d in queries])
+        _, sell_time = _timed(lambda: [market.sell(s, d) for s, d in queries])
+        _, snap_time = _timed(lambda: [market.data[d] for d in snapshot_dates])
+        results[name]["buy_us"] = 1e6 * buy_time / lookups
+        results[name]["sell_us"] = 1e6 * sell_time / lookups
+        results[name]["snapshot_us"] = 1e6 * snap_time / len(snapshot_dates)
+
+    for name, result in results.items():
+        print(name, ", ".join(f"{k} {v:.3f}" for k, v in result.items()))
+    return results
+
+def bench_store_open(data_file="./data/intraday_datetimes_1min.pkl", store_dir="./data/intraday_1min", stocks=["AMZN"]):
+    """
+    Time from nothing to a market ready for the first tick.
+    Pickle load against opening the memory mapped store
+    """
+    _, pickle_time = _timed(StockMarketDict, stocks=stocks, data_file=data_file)
+    _, store_all_time = _timed(StockMarketArray.from_store, store_dir)
+    _, store_time = _timed(StockMarketArray.from_store, store_dir, stocks=stocks)
+    results = {"pickle_s": pickle_time, "store_all_s": store_all_time, "store_stocks_s": store_time}
+    print(", ".join(f"{k} {v:.4f}" for k, v in results.items()))
+    return results
+
+def _scan_current_price(dataframe, day_str, ticker):
+    """ How StockMarketDataFrame.current_price used to find a price
+    """
+    results = dataframe.loc[lambda x: (x["timestamp"] == day_str) &
+                                      (x["company"] == ticker)]["open"]
+    if (results.empty):
+        return None
+    return results.values[0]
+
+def bench_dataframe_market(data_file="daily_all.csv", days=200):
+    """
+    Indexed StockMarketDataFrame against the boolean scan it replaced.
+    Looks up every company on the first days trading days
+    """
+    market = StockMarketDataFrame(data_file)
+    raw = pd.read_csv(data_file)
+    start_day = market.dataframe["timestamp"].iloc[0].date()
+    queries = []
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        queries.extend((day, stock) for stock in market.cross_section(day)["company"])
+
+    def indexed():
+        for day, stock in queries:
+            market.current_date = day
+            market.current_price(stock)
+
+    def scanned():
+        for day, stock in queries:
+            _scan_current_price(raw, day.strftime("%Y-%m-%d"), stock)
+
+    _, indexed_time = _timed(indexed)
+    _, scan_time = _timed(scanned)
+    results = {"lookups": len(queries),
+               "indexed_us": 1e6 * indexed_time / max(len(queries), 1),
+               "scan_us": 1e6 * scan_time / max(len(queries), 1)}
+    print(", ".join(f"{k} {v:.2f}" for k, v in results.items()))
+    return results
+
+def bench_rolling_window(windows=(20, 120, 480), universes=(10, 100, 500), ticks=200):
+    """
+    Per tick cost of keeping a window of every symbol.
+    The np.append copy the agents used to do against RollingWindow,
+    both one symbol at a time and all symbols in one push
+    """
+    results = []
+    for window in windows:
+        for universe in universes:
+            values = np.random.random((ticks, universe))
+            symbols = list(range(universe))
+
+            history = {s: np.random.random(window) for s in symbols}
+            def appended():
+                for t in range(ticks):
+                    for s in symbols:
+                        history[s] = np.append(history[s][1:], values[t, s])
+
+            rolling = RollingWindow(window, symbols=symbols)
+            def pushed():
+                for t in range(ticks):
+                    for s in symbols:
+                        rolling.push(s, values[t, s])
+
+            rows = np.arange(universe)
+            def pushed_rows():
+                for t in range(ticks):
+                    rolling.push_rows(rows, values[t])
+
+            result = {"window": window, "universe": universe}
+            for name, func in [("append", appended), ("push", pushed), ("push_rows", pushed_rows)]:
+                _, seconds = _timed(func)
+                result[f"{name}_us_per_tick"] = 1e6 * seconds / ticks
+            print(", ".join(f"{k} {v:.1f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+            results.append(result)
+    return results
+
+def bench_replay(data_file="./data/intraday_datetimes_1min.pkl", stocks=None):
+    """
+    Time working out every tick's decisions streaming through decide
+    against computing them all at once with compute_signals
+    """
+    market = StockMarketArray(data_file=data_file)
+    if (stocks == None):
+        stocks = market.symbols
+    results = []
+    for make_agent in [lambda: AgentMACD(stocks=stocks), lambda: AgentMeanReversion(stocks=stocks)]:
+        agent = make_agent()
+        def streamed():
+            return [agent.decide(market.data[day]) for day in market.dates]
+        _, stream_seconds = _timed(streamed)
+        _, signal_seconds = _timed(make_agent().compute_signals, market)
+        result = {"agent": type(agent).__name__, "ticks": len(market.dates), "stocks": len(stocks),
+                  "stream_s": stream_seconds, "signals_s": signal_seconds,
+                  "speedup": stream_seconds / signal_seconds}
+        print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+        results.append(result)
+    return results
+
+def bench_indicator_cache(data_file="./data/intraday_datetimes_1min.pkl", stocks=None,
+                          avg_ranges=(5, 10, 20), trend_modifiers=(2, 3, 4)):
+    """
+    Time compute_signals over a grid of AgentMeanReversion parameters
+    and AgentMACD with an empty indicator cache and again with it filled
+    """
+    market = StockMarketArray(data_file=data_file)
+    if (stocks == None):
+        stocks = market.symbols
+    agents = [AgentMeanReversion(stocks, avg_range=a, trend_modifier=m)
+              for a in avg_ranges for m in trend_modifiers]
+    agents += [AgentMACD(stocks, mac1_num=26, mac2_num=12, macd_num=9)]
+    def sweep():
+        for agent in agents:
+            agent.compute_signals(market)
+    indicators.CACHE.clear()
+    _, cold_seconds = _timed(sweep)
+    _, warm_seconds = _timed(sweep)
+    result = {"agents": len(agents), "stocks": len(stocks), "cold_s": cold_seconds, "warm_s": warm_seconds,
+              "cached_series": len(indicators.CACHE), "hits": indicators.CACHE.hits}
+    print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+    return result
+
+def bench_decision_tracker(data_file="./data/intraday_datetimes_1min.pkl", stocks=None):
+    """
+    Memory held by keeping every tick's AgentMACD decisions as a
+    Decision per stock in dicts against the columnar DecisionTracker
+    """
+    market = StockMarketArray(data_file=data_file)
+    if (stocks == None):
+        stocks = market.symbols
+    signals = AgentMACD(stocks=stocks).compute_signals(market)
+
+    def as_dicts():
+        tracker = {}
+        for t, day in enumerate(market.dates):
+            decisions = signals.decisions(t)
+            tracker[day] = {stock: decisions.get(stock) if (decisions.actions[i] != 0) else Decision()
+                            for i, stock in enumerate(stocks)}
+        return tracker
+
+    def as_columns():
+        tracker = DecisionTracker(signals.names)
+        for t in range(len(market.dates)):
+            tracker.record(t, signals.decisions(t))
+        return tracker
+
+    result = {"ticks": len(market.dates), "stocks": len(stocks)}
+    for name, func in [("dicts", as_dicts), ("columns", as_columns)]:
+        _, seconds, held = _traced(func)
+        result[f"{name}_s"] = seconds
+        result[f"{name}_mb"] = held / 2**20
+    print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+    return result
+
+def bench_backtest(data_file="./data/intraday_datetimes_1min.pkl", stocks=None, close_time="19:59:00"):
+    """
+    Time the Executor against the vectorized backtest on the same
+    AgentMACD and AgentMeanReversion signals. Results are checked to match
+    """
+    market = StockMarketArray(data_file=data_file)
+    if (stocks == None):
+        stocks = market.symbols
+    results = []
+    for make_agent in [lambda s: AgentMACD(stocks=s), lambda s: AgentMeanReversion(stocks=s)]:
+        executor_seconds, vector_seconds = check_backtest_parity(market, make_agent, stocks, close_time=close_time)
+        results.append({"agent": type(make_agent(stocks)).__name__, "executor_s": executor_seconds,
+                        "vectorized_s": vector_seconds, "speedup": executor_seconds / vector_seconds})
+        print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in results[-1].items()))
+    return results
+
+def bench_portfolio(trades=(1000, 10000, 100000), calls=10000):
+    """
+    Time valuing a portfolio after many trades with the running totals
+    against summing over the holdings like it used to be done
+    """
+    results = []
+    for n in trades:
+        portfolio = Portfolio(cash=1e12)
+        for i in range(n):
+            portfolio.add("AMZN", 100.0, i, 1)
+            portfolio.sold("AMZN", 101.0, i, 1)
+        historical, active = list(portfolio.historical), portfolio.active
+        def summed():
+            for _ in range(calls):
+                sum([h.profit for h in historical]) + sum([a.buy_price for a in active]) + portfolio.cash
+        def running():
+            for _ in range(calls):
+                portfolio.total_value
+        result = {"trades": n}
+        for name, func in [("summed", summed), ("running", running)]:
+            _, seconds = _timed(func)
+            result[f"{name}_us_per_call"] = 1e6 * seconds / calls
+        print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+        results.append(result)
+    return results
+
+def bench_ledger(fills=(10000, 100000, 1000000), symbols=50):
+    """
+    Time and memory of round trips through the Portfolio ledger against
+    keeping a Holding object for every trade like it used to be done.
+    Every fill is on a tick of its own, like 1 minute data. The timestamps
+    belong to the market and are made before timing
+    """
+    results = []
+    names = [f"S{i}" for i in range(symbols)]
+    for n in fills:
+        dates = [f"t{i}" for i in range(n)]
+        def ledger():
+            portfolio = Portfolio(cash=1e12)
+            portfolio.dates = dates
+            for i in range(n // 2):
+                stock = names[i % symbols]
+                portfolio.add(stock, 100.0, 2 * i, 1)
+                portfolio.holds(stock)
+                portfolio.sold(stock, 101.0, 2 * i + 1, 1)
+            return portfolio
+        def objects():
+            holdings = []
+            for i in range(n // 2):
+                holding = Holding(names[i % symbols], 100.0, dates[2 * i], 1)
+                holding.sell(101.0, dates[2 * i + 1])
+                holdings.append(holding)
+            return holdings
+        result = {"fills": n}
+        for name, func in [("ledger", ledger), ("objects", objects)]:
+            _, seconds, held = _traced(func)
+            result[f"{name}_s"] = seconds
+            result[f"{name}_mb"] = held / 1e6
+        print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+        results.append(result)
+    return results
+
+def bench_time_axis(data_file="./data/intraday_datetimes_1min.pkl", close_time="18:30:00"):
+    """
+    Time the per tick date handling of Executor.run and DrawDown.calc
+    parsing the date strings like it used to be done against reading
+    the market's precomputed time arrays
+    """
+    market = StockMarketArray(data_file=data_file)
+    dates = market.dates
+    def parsed():
+        for day in dates:
+            current_date, current_time = split_datetime_str(day)
+            closing = (current_time == close_time)
+            # DrawDown parsed the peak and the current date below a peak
+            days = (convert_date(day, time=True) - convert_date(dates[0], time=True)).days
+    def arrays():
+        close_seconds = seconds_of_day(close_time)
+        times = market.times.tolist()
+        session_dates = market.session_date.tolist()
+        times_of_day = market.time_of_day.tolist()
+        for t in range(len(dates)):
+            current_date = session_dates[t]
+            closing = (times_of_day[t] == close_seconds)
+            days = (times[t] - times[0]) // 86400
+    result = {"ticks": len(dates)}
+    for name, func in [("parsed", parsed), ("arrays", arrays)]:
+        _, seconds = _timed(func)
+        result[f"{name}_s"] = seconds
+    result["speedup"] = result["parsed_s"] / result["arrays_s"]
+    print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+    return result
+
+def bench_metrics(runs=1000, sessions=250, ticks_per_session=390, seed=0):
+    """
+    Time the risk metrics of many equity curves: vectorized over a
+    (runs x time) matrix at once, one run at a time with metrics.summary,
+    and fed tick by tick to StreamingMetrics (a tenth of the runs)
+    """
+    rng = np.random.default_rng(seed)
+    n = sessions * ticks_per_session
+    times = (np.repeat(np.arange(sessions) * 86400, ticks_per_session) +
+             np.tile(np.arange(ticks_per_session) * 60, sessions) + 1596461400)
+    values = 10000 * np.exp(np.cumsum(rng.normal(0, 1e-4, (runs, n)), axis=1))
+    def matrix():
+        returns = metrics.period_returns(metrics.session_closes(values, times // 86400))
+        return (metrics.sharpe(returns), metrics.sortino(returns), metrics.calmar(returns, values),
+                metrics.volatility(returns), metrics.rolling_volatility(returns))
+    def each():
+        return [metrics.summary(row, times) for row in values]
+    def streaming():
+        for row in values[:max(runs // 10, 1)]:
+            accumulator = metrics.StreamingMetrics()
+            for value, t in zip(row.tolist(), times.tolist()):
+                accumulator.update(value, t)
+            accumulator.summary()
+    result = {"runs": runs, "ticks": n}
+    for name, func in [("matrix", matrix), ("each", each), ("streaming", streaming)]:
+        _, seconds = _timed(func)
+        result[f"{name}_ms_per_run"] = 1e3 * seconds / (max(runs // 10, 1) if (name == "streaming") else runs)
+    print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+    return result
+
+def bench_portfolio_tracker(ticks=(100000, 1000000), ticks_per_session=390):
+    """
+    Time and memory of recording a value every tick in an OrderedDict
+    keyed by date strings like it used to be done against the
+    PortfolioTracker columns, every tick, every 10th and session closes
+    """
+    results = []
+    for n in ticks:
+        times = 1596461400 + (np.arange(n) // ticks_per_session) * 86400 + (np.arange(n) % ticks_per_session) * 60
+        dates = [f"day {t}" for t in range(n)]
+        def ordered():
+            tracker = OrderedDict()
+            for t in range(n):
+                tracker[dates[t]] = 100.0 + t
+            return tracker
+        def tracked(every=1, session_close=False):
+            tracker = PortfolioTracker(times, every=every, session_close=session_close)
+            for t in range(n):
+                tracker.record(t, 10000.0 + t, 5000.0, 100.0 + t)
+            return tracker
+        result = {"ticks": n}
+        for name, func in [("dict", ordered), ("columns", tracked),
+                           ("every_10", lambda: tracked(every=10)), ("session_close", lambda: tracked(session_close=True))]:
+            _, seconds, held = _traced(func)
+            result[f"{name}_s"] = seconds
+            result[f"{name}_mb"] = held / 1e6
+        print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+        results.append(result)
+    return results
+
+def bench_checkpoint(data_file="./data/intraday_datetimes_1min.pkl", stocks=None, every=10000,
+                     directory="./checkpoints/bench"):
+    """
+    Time every checkpoint of an AgentMACD run and the bytes it writes,
+    against pickling the ledger and trackers whole each time
+    """
+    market = StockMarketArray(data_file=data_file)
+    if (stocks == None):
+        stocks = market.symbols
+    results = []
+
+    class TimedCheckpoint(Checkpoint):
+        def save(self, executor, next_tick):
+            before = sum([os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory)])
+            _, seconds = _timed(Checkpoint.save, self, executor, next_tick)
+            after = sum([os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory)])
+            whole, whole_seconds = _timed(pickle.dumps, (executor.portfolio, executor.portfolio_tracker,
+                                                         executor.decision_tracker))
+            result = {"tick": next_tick, "checkpoint_ms": 1e3 * seconds, "grew_kb": (after - before) / 1e3,
+                      "whole_ms": 1e3 * whole_seconds, "whole_kb": len(whole) / 1e3}
+            print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
+            results.append(result)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    executor = Executor(AgentMACD(stocks=stocks), market, Portfolio(cash=10000), stocks, time=True)
+    executor.run(checkpoint=TimedCheckpoint(directory, every=every))
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+if __name__ == "__main__":
+    bench_market_backends()
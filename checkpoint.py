@@ -0,0 +1,190 @@
+"""
+Checkpoints of long Executor backtests, so a crashed run carries on
+from its last checkpoint instead of starting over.
+
+    checkpoint = Checkpoint("./checkpoints/macd", every=100000)
+    executor.run(checkpoint=checkpoint)
+    # After a crash, with the same market
+    executor = resume("./checkpoints/macd", market)
+
+A checkpoint directory holds
+
+    state.pkl        agent, pending orders, open positions, metrics and
+                     the row counts of the columns, replaced atomically
+    <column>.bin     raw rows of the trade ledger and tracker columns
+
+Columns only ever get rows added, so each checkpoint appends the rows
+made since the one before. The cost of a checkpoint depends on the
+ticks since the last one and the size of the agent's windows, not on
+the length of the run. Rows past the counts in state.pkl (left by a
+crash between writing columns and state) are ignored and overwritten.
+"""
+import os
+import pickle
+import random
+
+import numpy as np
+
+from main import Executor
+from portfolio import TRADE, Portfolio
+from trackers import DecisionTracker
+
+def _fingerprint(market):
+    dates = market.dates
+    return (len(dates), dates[0] if len(dates) else None, dates[-1] if len(dates) else None)
+
+def _write_at(path, offset, data):
+    """ Write bytes at offset, dropping anything after them
+    """
+    with open(path, "r+b" if os.path.exists(path) else "wb") as fh:
+        fh.seek(offset)
+        fh.write(data)
+        fh.truncate()
+        fh.flush()
+        os.fsync(fh.fileno())
+
+def _read_rows(path, dtype, rows, shape=()):
+    count = rows * int(np.prod(shape, dtype=np.int64))
+    if (count == 0):
+        return np.zeros((rows,) + tuple(shape), dtype=dtype)
+    return np.fromfile(path, dtype=dtype, count=count).reshape((rows,) + tuple(shape))
+
+class Checkpoint:
+    """
+    Saves the state of an Executor to directory every `every` ticks
+    of Executor.run and once more when it finishes.
+    every defaults to what it was when loading a checkpoint
+    """
+
+    def __init__(self, directory, every=None):
+        self.directory = directory
+        self.every = every
+        # Rows of every column already on disk
+        self.written = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def due(self, t):
+        return (self.every != None) and ((t + 1) % self.every == 0)
+
+    def _columns(self, executor):
+        """ (name, column, rows that will not change any more) of everything appended to
+        """
+        portfolio = executor.portfolio
+        values = executor.portfolio_tracker
+        decisions = executor.decision_tracker
+        # The last entry of a session_close tracker can still change, it goes in the state
+        settled = max(len(values) - 1, 0)
+        columns = [("trades", portfolio.trades, portfolio.trade_count)]
+        columns += [("values_" + name, column, settled) for name, column in values.columns().items()]
+        columns += [("decisions_" + name, column, len(decisions)) for name, column in decisions.columns().items()]
+        return columns
+
+    def save(self, executor, next_tick):
+        """ Checkpoint executor, carrying on from next_tick
+        """
+        written = dict(self.written)
+        for name, column, rows in self._columns(executor):
+            start = written.get(name, 0)
+            row_bytes = column.itemsize * int(np.prod(column.shape[1:], dtype=np.int64))
+            _write_at(self._path(name + ".bin"), start * row_bytes, np.ascontiguousarray(column[start:rows]).tobytes())
+            written[name] = rows
+
+        portfolio = executor.portfolio
+        values = executor.portfolio_tracker
+        state = {
+            "every": self.every,
+            "next_tick": next_tick,
+            "market": _fingerprint(executor.market),
+            "written": written,
+            "executor": {name: getattr(executor, name) for name in
+                         ("stocks", "time", "close_time", "buy_next", "sell_next", "current_date", "done_for_day")},
+            "agent": executor.agent,
+            "metrics": executor.metrics,
+            "portfolio": {name: value for name, value in portfolio.__dict__.items()
+                          if name not in ("trades", "dates")},
+            "portfolio_tracker": {"every": values.every, "session_close": values.session_close,
+                                  "size": values.size, "seen": values.seen, "last_session": values.last_session,
+                                  "last": {name: column[values.size - 1] for name, column in values.columns().items()}
+                                          if (values.size > 0) else {}},
+            "decision_tracker": {"names": executor.decision_tracker.names,
+                                 "symbols": executor.decision_tracker.symbols,
+                                 "size": executor.decision_tracker.size},
+            "random": random.getstate(),
+        }
+        tmp = self._path("state.pkl.tmp")
+        with open(tmp, "wb") as fh:
+            pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self._path("state.pkl"))
+        self.written = written
+
+    def exists(self):
+        return os.path.exists(self._path("state.pkl"))
+
+    def load(self, market):
+        """
+        Executor as it was at the last checkpoint, on the same market
+
+        Returns:
+            executor, tick to carry on from
+        """
+        with open(self._path("state.pkl"), "rb") as fh:
+            state = pickle.load(fh)
+        assert state["market"] == _fingerprint(market), "Checkpoint was made on a different market"
+        if (self.every == None):
+            self.every = state["every"]
+        self.written = dict(state["written"])
+
+        portfolio = Portfolio.__new__(Portfolio)
+        portfolio.__dict__.update(state["portfolio"])
+        portfolio.trades = np.zeros(max(portfolio.trade_count, 1024), dtype=TRADE)
+        portfolio.trades[:portfolio.trade_count] = _read_rows(self._path("trades.bin"), TRADE, portfolio.trade_count)
+
+        info = state["executor"]
+        tracking = state["portfolio_tracker"]
+        executor = Executor(state["agent"], market, portfolio, info["stocks"], time=info["time"],
+                            close_time=info["close_time"], record_every=tracking["every"],
+                            record_session_close=tracking["session_close"])
+        for name in ("buy_next", "sell_next", "current_date", "done_for_day"):
+            setattr(executor, name, info[name])
+        executor.metrics = state["metrics"]
+        executor.drawdown = executor.metrics.drawdown
+
+        values = executor.portfolio_tracker
+        values.size, values.seen, values.last_session = tracking["size"], tracking["seen"], tracking["last_session"]
+        settled = max(values.size - 1, 0)
+        for name, column in values.columns().items():
+            column[:settled] = _read_rows(self._path(f"values_{name}.bin"), column.dtype, settled)
+            if (values.size > 0):
+                column[values.size - 1] = tracking["last"][name]
+
+        info = state["decision_tracker"]
+        decisions = DecisionTracker(info["names"], capacity=max(info["size"], 1024))
+        for symbol in info["symbols"]:
+            decisions.symbol_row(symbol)
+        decisions.size = info["size"]
+        for name, column in decisions.columns().items():
+            column[:decisions.size] = _read_rows(self._path(f"decisions_{name}.bin"), column.dtype,
+                                                 decisions.size, column.shape[1:])
+        executor.decision_tracker = decisions
+
+        random.setstate(state["random"])
+        return executor, state["next_tick"]
+
+def resume(directory, market, signals=None, every=None):
+    """
+    Carry on the backtest checkpointed in directory to the end of market,
+    checkpointing as it goes. signals as given to the first Executor.run
+
+    Returns:
+        the finished Executor
+    """
+    checkpoint = Checkpoint(directory, every)
+    assert checkpoint.exists(), f"No checkpoint in {directory}"
+    executor, start = checkpoint.load(market)
+    executor.run(signals=signals, start=start, checkpoint=checkpoint)
+    return executor
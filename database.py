@@ -0,0 +1,104 @@
+"""
+Connections to the stocks database. The tables are in
+scraping/stockdata.schema. MySQL is what gets used for real data,
+sqlite can stand in for it locally since the schema works for both.
+"""
+import itertools
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraping", "stockdata.schema")
+
+# Names for in memory sqlite databases
+_memory_names = itertools.count()
+
+class ConnectionPool:
+    """
+    Hands out up to size connections made with connect and
+    takes them back after use instead of closing them.
+        placeholder: parameter marker of the driver, %s for mysql ? for sqlite
+        prepared: ask the driver for prepared statement cursors
+    """
+
+    def __init__(self, connect, size=4, placeholder="%s", prepared=False):
+        self.connect = connect
+        self.size = size
+        self.placeholder = placeholder
+        self.prepared = prepared
+        self.idle = queue.LifoQueue()
+        self.created = 0
+
+    def _get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        if (self.created < self.size):
+            self.created += 1
+            return self.connect()
+        return self.idle.get()
+
+    @contextmanager
+    def connection(self):
+        con = self._get()
+        try:
+            yield con
+        finally:
+            self.idle.put(con)
+
+    def cursor(self, con):
+        if (self.prepared):
+            return con.cursor(prepared=True)
+        return con.cursor()
+
+    def sql(self, query):
+        """ Queries are written with ? and changed to the driver's marker
+        """
+        return query.replace("?", self.placeholder)
+
+    def fetchall(self, query, params=()):
+        with self.connection() as con:
+            cur = self.cursor(con)
+            cur.execute(self.sql(query), params)
+            results = cur.fetchall()
+            cur.close()
+        return results
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+        self.created = 0
+
+def mysql_pool(size=4, database="stocks"):
+    import mysql.connector
+    assert os.environ.get('DB_USER'), "Set mysql database user DB_USER"
+    assert os.environ.get('DB_PASS'), "Set mysql database password DB_PASS"
+    connect = lambda: mysql.connector.connect(user=os.environ.get('DB_USER'), database=database,
+                                              password=os.environ.get('DB_PASS'))
+    return ConnectionPool(connect, size=size, placeholder="%s", prepared=True)
+
+def sqlite_pool(database=":memory:", size=4):
+    """
+    Local stand in for the mysql database. ":memory:" gives
+    a database shared by the connections of this pool only.
+    """
+    if (database == ":memory:"):
+        uri = f"file:stocks_{next(_memory_names)}?mode=memory&cache=shared"
+        connect = lambda: sqlite3.connect(uri, uri=True, check_same_thread=False)
+    else:
+        connect = lambda: sqlite3.connect(database, timeout=60, check_same_thread=False)
+    return ConnectionPool(connect, size=size, placeholder="?")
+
+def create_tables(pool, schema_file=SCHEMA_FILE):
+    """ Run the table definitions in stockdata.schema
+    """
+    with open(schema_file, "r") as fh:
+        statements = [s.strip() for s in fh.read().split(";") if s.strip()]
+    with pool.connection() as con:
+        cur = con.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        con.commit()
+        cur.close()
@@ -0,0 +1,355 @@
+"""
+Indicators shared by the agents. Every indicator has two forms that
+give the same numbers:
+    update(values): streaming, one tick of values ordered by symbol with
+                    NaN where a symbol has no price. Returns the indicator
+                    after the tick.
+    compute(array): batch, a whole (time x symbol) array at once.
+Ticks without a price are skipped so every symbol runs over its own
+prices, and the result at a tick only uses prices up to that tick.
+Results are NaN on ticks without a price and until there is enough history.
+
+series() keeps batch results in a bounded LRU cache keyed by
+(symbol, indicator, params, field, market version) so agents and
+parameter sweeps working on the same market share the work.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from market import StockMarketArray
+from rolling import RollingWindow
+
+def window_trend(windows, half=None):
+    """
+    (mean of the newer part - mean of the first half) / mean of the newer part
+    of every window along the last axis
+    """
+    if (half == None):
+        half = windows.shape[-1] // 2
+    old = np.mean(windows[..., :half], axis=-1)
+    new = np.mean(windows[..., half:], axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (new - old) / new
+
+def previous(values, valid):
+    """
+    values at each symbol's previous tick with a price, i.e. an indicator
+    as it was just before the tick's price came in. NaN on ticks without a price
+    """
+    out = np.full(values.shape, np.nan)
+    for s in range(values.shape[1]):
+        rows = np.flatnonzero(valid[:, s])
+        out[rows[1:], s] = values[rows[:-1], s]
+    return out
+
+class Indicator:
+    """
+    Base of the indicators. State is made for the number of symbols of
+    the first update, or with start(size)
+    """
+
+    def __init__(self, n):
+        assert n > 0, "Indicator length must be positive"
+        self.n = n
+        self.params = (n,)
+        self.size = None
+
+    @property
+    def key(self):
+        return (type(self).__name__,) + self.params
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.params}"
+
+    def start(self, size):
+        self.size = size
+
+    def clear(self):
+        """ Forget all prices
+        """
+        if (self.size != None):
+            self.start(self.size)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if (self.size != len(values)):
+            self.start(len(values))
+        valid = ~np.isnan(values)
+        self._update(valid, values)
+        return np.where(valid, self.value, np.nan)
+
+    def compute(self, array):
+        array = np.asarray(array, dtype=np.float64)
+        if (array.ndim == 1):
+            return self.compute(array[:, None])[:, 0]
+        out = np.full(array.shape, np.nan)
+        for s in range(array.shape[1]):
+            rows = np.flatnonzero(~np.isnan(array[:, s]))
+            if (len(rows) >= self.n):
+                out[rows[self.n - 1:], s] = self._compute_windows(sliding_window_view(array[rows, s], self.n))
+        return out
+
+class EMA(Indicator):
+    """
+    Exponential moving average with alpha = 2/(n+1),
+    starting at a symbol's first price
+    """
+
+    def __init__(self, n):
+        super().__init__(n)
+        self.alpha = 2 / (n + 1)
+
+    def start(self, size):
+        super().start(size)
+        self.value = np.full(size, np.nan)
+        self.count = np.zeros(size, dtype=np.int64)
+
+    def _update(self, valid, x):
+        first = valid & (self.count == 0)
+        rest = valid & (self.count > 0)
+        self.value[first] = x[first]
+        self.value[rest] += self.alpha * (x[rest] - self.value[rest])
+        self.count[valid] += 1
+
+    def compute(self, array):
+        array = np.asarray(array, dtype=np.float64)
+        ewm = pd.DataFrame(array).ewm(span=self.n, adjust=False, ignore_na=True)
+        out = ewm.mean().to_numpy(copy=True).reshape(array.shape)
+        out[np.isnan(array)] = np.nan
+        return out
+
+class _Windowed(Indicator):
+    """
+    Indicators over the last n prices of each symbol. Running sums are
+    updated as prices enter and leave a RollingWindow, so a tick costs the
+    same whatever n is. Every resync_every ticks they are recomputed from
+    the window to stop rounding errors from adding up.
+    """
+
+    def __init__(self, n, resync_every=10000):
+        super().__init__(n)
+        self.resync_every = resync_every
+
+    def start(self, size):
+        super().start(size)
+        self.history = RollingWindow(self.n, symbols=range(size))
+        self.rows = np.arange(size)
+        self.ticks = 0
+
+    @property
+    def full(self):
+        return self.history.count[:self.size] == self.n
+
+    def _update(self, valid, x):
+        count = self.history.count[:self.size]
+        rows = self.rows[valid & (count == self.n)]
+        self._slide(rows, x[rows])
+        rows = self.rows[valid & (count < self.n)]
+        self._grow(rows, x[rows], count[rows])
+        self.history.push_rows(self.rows[valid], x[valid])
+        self.ticks += 1
+        if (self.ticks % self.resync_every == 0):
+            rows = self.rows[self.full]
+            self._resync(rows, self.history.windows(rows))
+
+class SMA(_Windowed):
+    """ Mean of the last n prices
+    """
+
+    def start(self, size):
+        super().start(size)
+        self.sum = np.zeros(size)
+
+    @property
+    def value(self):
+        return np.where(self.full, self.sum / self.n, np.nan)
+
+    def _slide(self, rows, x):
+        self.sum[rows] += x - self.history.lag(rows, self.n - 1)
+
+    def _grow(self, rows, x, count):
+        self.sum[rows] += x
+
+    def _resync(self, rows, windows):
+        self.sum[rows] = windows.sum(axis=1)
+
+    def _compute_windows(self, windows):
+        return windows.mean(axis=1)
+
+class RollingStd(_Windowed):
+    """
+    Standard deviation (ddof 0) of the last n prices, Welford style.
+    mean holds their average
+    """
+
+    def start(self, size):
+        super().start(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    @property
+    def value(self):
+        return np.where(self.full, np.sqrt(np.maximum(self.m2 / self.n, 0)), np.nan)
+
+    def _slide(self, rows, x):
+        evicted = self.history.lag(rows, self.n - 1)
+        old_mean = self.mean[rows]
+        new_mean = old_mean + (x - evicted) / self.n
+        self.m2[rows] += (x - evicted) * (x - new_mean + evicted - old_mean)
+        self.mean[rows] = new_mean
+
+    def _grow(self, rows, x, count):
+        delta = x - self.mean[rows]
+        self.mean[rows] += delta / (count + 1)
+        self.m2[rows] += delta * (x - self.mean[rows])
+
+    def _resync(self, rows, windows):
+        self.mean[rows] = windows.mean(axis=1)
+        self.m2[rows] = ((windows - self.mean[rows, None])**2).sum(axis=1)
+
+    def _compute_windows(self, windows):
+        return windows.std(axis=1)
+
+class TrendSlope(_Windowed):
+    """
+    Trend of the last n prices, window_trend of the first half
+    and the rest of the window
+    """
+
+    def __init__(self, n, half=None, resync_every=10000):
+        super().__init__(n, resync_every)
+        self.half = n // 2 if (half == None) else half
+        assert 0 < self.half < n, "Trend needs prices in both parts of the window"
+        self.params = (n, self.half)
+
+    def start(self, size):
+        super().start(size)
+        self.old_sum = np.zeros(size)
+        self.new_sum = np.zeros(size)
+
+    @property
+    def value(self):
+        new = self.new_sum / (self.n - self.half)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trend = (new - self.old_sum / self.half) / new
+        return np.where(self.full, trend, np.nan)
+
+    def _slide(self, rows, x):
+        # Oldest price leaves, the middle one changes halves
+        evicted = self.history.lag(rows, self.n - 1)
+        middle = self.history.lag(rows, self.n - 1 - self.half)
+        self.old_sum[rows] += middle - evicted
+        self.new_sum[rows] += x - middle
+
+    def _grow(self, rows, x, count):
+        in_old = count < self.half
+        self.old_sum[rows[in_old]] += x[in_old]
+        self.new_sum[rows[~in_old]] += x[~in_old]
+
+    def _resync(self, rows, windows):
+        self.old_sum[rows] = windows[:, :self.half].sum(axis=1)
+        self.new_sum[rows] = windows[:, self.half:].sum(axis=1)
+
+    def _compute_windows(self, windows):
+        return window_trend(windows, self.half)
+
+class IndicatorCache:
+    """
+    Least recently used computed series, holding at most max_bytes.
+    Cached arrays are read only since they are handed out to everyone
+    """
+
+    def __init__(self, max_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self.series = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.series)
+
+    def get(self, key):
+        values = self.series.get(key)
+        if (values is None):
+            self.misses += 1
+            return None
+        self.series.move_to_end(key)
+        self.hits += 1
+        return values
+
+    def put(self, key, values):
+        values.setflags(write=False)
+        old = self.series.pop(key, None)
+        if (old is not None):
+            self.nbytes -= old.nbytes
+        self.series[key] = values
+        self.nbytes += values.nbytes
+        while (self.nbytes > self.max_bytes) and (len(self.series) > 0):
+            _, evicted = self.series.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self.series.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+CACHE = IndicatorCache()
+
+def array_market(market):
+    """
+    StockMarketArray of market, converted from the dictionary of a
+    StockMarketDict if need be. Convert once and pass the result on.
+    Converted markets have no version so series() does not cache them,
+    nothing else would ever ask for those entries
+    """
+    if isinstance(market, StockMarketArray):
+        return market
+    converted = StockMarketArray.from_dict(market.data)
+    converted.version = None
+    return converted
+
+def market_field(market, symbols, field="close"):
+    """
+    (time x symbol) prices of field over all of the market's dates.
+    NaN where a symbol has no price
+    """
+    market = array_market(market)
+    prices = market.field(field)
+    out = np.full((len(market.dates), len(symbols)), np.nan)
+    for j, symbol in enumerate(symbols):
+        s = market.symbol_index.get(symbol)
+        if (s != None):
+            out[:, j] = prices[:, s]
+    return out
+
+def series(market, symbols, indicator, field="close", cache=CACHE):
+    """
+    (time x symbol) batch values of indicator over field of the market.
+    Columns already worked out for the same market version come from
+    cache, the rest are computed together and added to it.
+    Markets converted by array_market are not cached.
+    """
+    market = array_market(market)
+    if (market.version == None):
+        cache = None
+    out = np.full((len(market.dates), len(symbols)), np.nan)
+    keys = [(symbol, indicator.key, field, market.version) for symbol in symbols]
+    missing = []
+    for j, key in enumerate(keys):
+        values = None if (cache == None) else cache.get(key)
+        if (values is None):
+            missing.append(j)
+        else:
+            out[:, j] = values
+    if (len(missing) > 0):
+        computed = indicator.compute(market_field(market, [symbols[j] for j in missing], field))
+        for i, j in enumerate(missing):
+            out[:, j] = computed[:, i]
+            if (cache != None):
+                cache.put(keys[j], computed[:, i].copy())
+    return out
@@ -1,73 +1,59 @@
-from collections import OrderedDict
+import numpy as np
 from agent import AgentMACD, AgentMeanReversion, AgentWaveTrend, AgentRandom
-from market import StockMarketDict
+from market import load_market
 from portfolio import Portfolio
 from plotter import plot_value_tracker, plot_buy_sell_points, plot_decision_vars
-from agent import Decision
+from agent import Decisions, SELL, no_decisions
+from metrics import DrawDown, StreamingMetrics
+from trackers import DecisionTracker, PortfolioTracker
 
-from utils import convert_date, split_datetime_str
-
-class DrawDown:
-    """
-    Calulates and stored the maximum drawdown time and value.
-    Defined as the time between the newest peak value and until it
-    crosses into a new peak value.
-    The high will then be the difference between the peak and the lowest for
-    the given time frame
-    """
-
-    def __init__(self, time=True):
-        self.time = time # Used in converting dates. if time is there or not
-        self.last_peak = 0
-        self.peak_date = ""
-        self.max_time = 0
-        self.max_height = 0
-
-    def calc(self, value, day):
-        if (value > self.last_peak):
-            self.last_peak = value
-            self.peak_date = day
-
-        elif (value < self.last_peak):
-
-            last_day = convert_date(self.peak_date, time=self.time)
-            new_day  = convert_date(day, time=self.time)
-            if (last_day == ""):
-                self.max_time = max(self.max_time, 0)
-            else:
-                self.max_time = max(self.max_time, (new_day - last_day).days)
-
-            if (self.max_height < self.last_peak - value):
-                self.max_height = self.last_peak - value
+from utils import seconds_of_day
 
 class Executor:
     """
     Handles logic between agent and incoming data
+
+    Values of the tracked ticks are kept in portfolio_tracker, record_every
+    and record_session_close thin it out (see trackers.PortfolioTracker).
+    metrics sees every tracked tick either way
     """
 
-    def __init__(self, agent, market, portfolio, stocks, time=False, close_time="18:30:00"):
+    def __init__(self, agent, market, portfolio, stocks, time=False, close_time="18:30:00",
+                 record_every=1, record_session_close=False):
         self.agent = agent
         self.market = market
         self.portfolio = portfolio
         self.stocks = stocks
         self.time = time
         self.market.set_stocks(self.stocks)
+        # Fills are dated by tick, the portfolio shows them as the market's dates
+        self.portfolio.dates = self.market.dates
+        self.tick = 0
         self.buy_next =  {}
         self.sell_next = {}
         self.dates = self.market.dates
         self.current_data = None
         self.close_time = close_time
+        self.close_seconds = seconds_of_day(close_time)
 
         # Metrics to evaluate strategies
-        self.value_tracker = OrderedDict()
-        self.decision_tracker = OrderedDict()
-        self.drawdown = DrawDown(time=time)
-
-        # Keep track of day so we can reset things every day
-        self.current_date = ""
+        self.portfolio_tracker = PortfolioTracker(self.market.times, every=record_every,
+                                                  session_close=record_session_close)
+        self.decision_tracker = DecisionTracker(getattr(agent, "variable_names", ()))
+        self.metrics = StreamingMetrics()
+        self.drawdown = self.metrics.drawdown
+
+        # Keep track of day so we can reset things every day. Days since epoch
+        self.current_date = None
         # Done for the day. If we want close positions at end of time period
         self.done_for_day = False
 
+    @property
+    def value_tracker(self):
+        """ {day: gain} of the recorded ticks
+        """
+        return self.portfolio_tracker.value_tracker(self.dates)
+
     def reset_dict(self, default_value):
         """
         Useful function to create a dictionary with stocks as keys
@@ -79,14 +65,21 @@ class Executor:
         price = self.market.buy(stock, day)
 #        print(f"buying {stock} for {price} on {day}")
         if (price != None):
-            self.portfolio.add(stock, price, day, quantity)
+            cash = self.portfolio.cash
+            self.portfolio.add(stock, price, self.tick, quantity)
+            if (self.portfolio.cash != cash):
+                self.metrics.add_fill(cash - self.portfolio.cash)
         return price
 
     def sell_order(self, stock, day, quantity):
         price = self.market.sell(stock, day)
 #        print(f"selling {stock} for {price} on {day}")
         if (price != None):
-            self.portfolio.sold(stock, price, day, quantity)
+            cash, realized = self.portfolio.cash, self.portfolio.realized
+            self.portfolio.sold(stock, price, self.tick, quantity)
+            if (self.portfolio.cash != cash):
+                self.metrics.add_fill(self.portfolio.cash - cash)
+                self.metrics.add_trade(self.portfolio.realized - realized)
         return price
 
     def process_orders(self, day):
@@ -111,94 +104,120 @@ class Executor:
 
         return results
 
-    def run(self):
+    def observe(self, t, day, signals=None):
+        """
+        Decisions of the agent at tick t. The agent sees every tick,
+        either through decide or replayed from signals worked out
+        up front with agent.compute_signals(market)
+        """
+        if (signals != None):
+            return signals.decisions(t)
+        return self.agent.decide(self.market.data[day])
+
+    def run(self, signals=None, start=0, checkpoint=None):
+        """
+        Step through the market from tick start.
+            checkpoint: checkpoint.Checkpoint saving the state as it goes,
+                        see checkpoint.resume to carry on from one
+        """
 
+        # Dates are parsed once by the market, plain ints are quicker to compare than numpy's
+        times = self.market.times.tolist()
+        session_dates = self.market.session_date.tolist()
+        times_of_day = self.market.time_of_day.tolist()
         # This not necessaryly the date its just next time when data comes.
-        for day in self.market.dates:
-            current_date, current_time = split_datetime_str(day)
-            decisions = {}
+        for t in range(start, len(self.market.dates)):
+            day = self.market.dates[t]
+            # Orders are filled on this tick
+            self.tick = t
+            current_date = session_dates[t]
+            decisions = no_decisions()
             # Sell and quit for the day
-            if (current_time == self.close_time):
-                done_for_day = True
+            if (times_of_day[t] == self.close_seconds):
+                self.done_for_day = True
                 self.agent.clear()
                 self.buy_next = {}
-                for stock in self.portfolio.current_stocks:
-                    #print(f"selling {stock} for the day")
-                    decisions[stock] = Decision("SELL")
+                held = self.portfolio.current_stocks
+                decisions = Decisions(held, np.full(len(held), SELL, dtype=np.int8))
 
-            # Reset things on new day
+            # Reset things on new day. The agent has kept up with the ticks
+            # after the close, it starts the session afresh like at the close
             if (self.current_date != current_date):
                 #print("new day")
                 #print(current_date)
                 self.current_date = current_date
                 self.done_for_day = False
+                self.agent.clear()
 
             # When the agent make a decision they put in order
             # for the next time step. Here they are send to the market to
             # be bought or sold and the given price.
             self.process_orders(day)
+            if (self.portfolio.mark_to_market):
+                self.portfolio.mark(self.market, day)
+
+            # The agent keeps up with the market even when not trading
+            # so streaming and replayed signals stay the same
+            observed = self.observe(t, day, signals)
 
             if not self.done_for_day:
                 # Metric tracking
                 value = self.portfolio.total_value
                 gain = self.portfolio.total_gain
-                self.drawdown.calc(value, day)
-                self.value_tracker[day] = gain
-
-                # Im actually gathering all the data for every stock
-                # Not using the iterator method that is in StockMarketDict
-                data = self.market.data[day]
+                self.metrics.update(value, times[t])
 
-                decisions = self.agent.decide(data)
-                self.decision_tracker[day] = decisions
+                decisions = observed
+                self.portfolio_tracker.record(t, value, self.portfolio.cash, gain, decisions)
+                self.decision_tracker.record(t, decisions)
 
                 # Only buy once a day
-                if (decisions != {}):
+                if (len(decisions) > 0):
                     self.done_for_day = True
 
             # Handle Decisions
-            for stock in decisions.keys():
-                stock_decision = decisions[stock]
+            for stock, result in decisions.items():
 
                 # Set to buy or sell on next day
-                if (stock_decision.result == "BUY"):
+                if (result == "BUY"):
                     # Only buy a max quantity of 1 stock at a time.
-                    if (stock not in self.portfolio.current_stocks):
+                    if not self.portfolio.holds(stock):
                         self.buy_next[stock] = True
-                elif (stock_decision.result == "SELL"):
+                elif (result == "SELL"):
                     self.sell_next[stock] = True
 
+            if (checkpoint != None) and checkpoint.due(t):
+                checkpoint.save(self, t + 1)
+
+        if (checkpoint != None):
+            checkpoint.save(self, len(self.market.dates))
 
-def random_runs(num_runs=1000):
+def random_runs(num_runs=1000, seed=0, processes=None):
     """
     Base line random buy and hold a stock for a day to get idea if other cases
     are significant;y better
+
+    Runs are spread over processes, each with its own random stream
+    spawned from seed. Returns a summary of the final gain distribution
     """
-    test_file = "./data/intraday_datetimes_1min.pkl"
+    from montecarlo import run_monte_carlo
+
+    test_file = "./data/intraday_1min"
     stock = "AMZN"
     stocks = [stock]
-    market = StockMarketDict(random_price=False, data_file=test_file)
-    agent = AgentRandom(stocks=stocks)
-    portfolio = Portfolio(cash=10000)
-    # value_tracker is an ordered dictionary. Get last value as total gain %
-    gains = []
-    for _ in range(num_runs):
-        portfolio = Portfolio(cash=10000)
-        executor = Executor(market = market, agent=agent, portfolio=portfolio, stocks=stocks, time=days)
-        executor.run()
-        gain = list(executor.value_tracker.values())[-1]
-        gains.append(gain)
-    return gains
+    market = load_market(test_file, stocks=stocks, random_price=False)
+    return run_monte_carlo(market, AgentRandom, num_runs=num_runs, seed=seed, stocks=stocks, processes=processes)
 
 if __name__ == "__main__":
      days = True
+     # Stores are made from the pickles with
+     #     python store.py ./data/intraday_datetimes_1min.pkl ./data/intraday_1min
      if days:
-         test_file = "./data/intraday_datetimes_1min.pkl"
+         test_file = "./data/intraday_1min"
      else:
          test_file = "./data/daily_all.pkl"
      stock = "AMZN"
      stocks = [stock] #, "FB", "ATVI", "MO", "AIG", "GOOG", "CNP", "BSX"]
-     market = StockMarketDict(random_price=False, data_file=test_file)
+     market = load_market(test_file, stocks=stocks, random_price=False)
      #agent = AgentMACD(stocks=stocks, mac1_num=26, mac2_num=12, macd_num=9)
      #agent = AgentMeanReversion(stocks=stocks)
      #agent = AgentWaveTrend(stocks=stocks, window_size=120)
@@ -1,10 +1,18 @@
-import mysql.connector
+import numpy as np
 import pandas as pd
 import random
 import pickle
 import os
+import itertools
+from collections import OrderedDict
 from datetime import datetime, date, timedelta
 
+from database import mysql_pool
+from store import FIELDS, OPEN, HIGH, LOW, dict_to_arrays, open_store, time_axis
+
+# Every loaded set of prices gets its own version, used as part of cache keys
+_versions = itertools.count()
+
 
 class StockMarketDict:
     """
@@ -19,6 +27,8 @@ class StockMarketDict:
         with open(self.data_file, "rb") as fh:
             self.data = pickle.load(fh)
         self.dates = list(sorted(self.data.keys()))
+        # Dates parsed once: seconds since epoch, session day and seconds into the day
+        self.times, self.session_date, self.time_of_day = time_axis(self.dates)
         self.stocks = stocks
 
     def set_stocks(self, stocks):
@@ -80,19 +90,240 @@ class StockMarketDict:
         if current_date not in self.data.keys():
             return None
 
-        result = self.data[formatted_date][stock].get('open')
-        if (not result):
-                return None
-        return result
+        stock_data = self.data[current_date].get(stock)
+        if (stock_data == None):
+            return None
+        return stock_data.get("open")
+
+class MarketSnapshots:
+    """
+    Read only stand in for StockMarketDict.data
+    Builds the {company: {open: close: ...}} dictionary for a
+    timestamp when asked for instead of keeping them all around
+    """
+
+    def __init__(self, market):
+        self.market = market
+
+    def __getitem__(self, day):
+        return self.market.snapshot(day, all_stocks=True)
+
+    def __contains__(self, day):
+        return day in self.market.date_index
+
+    def __len__(self):
+        return len(self.market.dates)
+
+    def __iter__(self):
+        return iter(self.market.dates)
+
+    def get(self, day, default=None):
+        if day not in self.market.date_index:
+            return default
+        return self[day]
+
+    def keys(self):
+        return self.market.dates
+
+class StockMarketArray:
+    """
+    Used for backtesting. Same interface as StockMarketDict
+    but the prices live in one dense array
+
+        prices[time, symbol, field]
+
+    with dictionaries from timestamp and company to row and column.
+    Missing values are NaN.
+
+    times, session_date and time_of_day are int64 arrays over the dates,
+    seconds since epoch, days since epoch and seconds into the day.
+    """
+
+    def __init__(self, stocks=[], random_price=False, data_file="./data/intraday_datetimes_1min.pkl", dtype=np.float64):
+        with open(data_file, "rb") as fh:
+            data = pickle.load(fh)
+        dates, symbols, prices = dict_to_arrays(data, dtype=dtype)
+        del data
+        self._setup(dates, symbols, prices, stocks, random_price)
+        self.data_file = data_file
+
+    @classmethod
+    def from_dict(cls, data, stocks=[], random_price=False, dtype=np.float64):
+        """ Build from an already loaded StockMarketDict style dictionary
+        """
+        dates, symbols, prices = dict_to_arrays(data, dtype=dtype)
+        return cls.from_arrays(dates, symbols, prices, stocks=stocks, random_price=random_price)
+
+    @classmethod
+    def from_store(cls, root, stocks=[], start=None, end=None, random_price=False):
+        """
+        Open a store written by store.write_store. Only the given
+        stocks and the time range [start, end] are read from disk
+        """
+        dates, symbols, prices = open_store(root, stocks=stocks, start=start, end=end)
+        market = cls.from_arrays(dates, symbols, prices, stocks=stocks, random_price=random_price)
+        market.data_file = root
+        return market
+
+    @classmethod
+    def from_arrays(cls, dates, symbols, prices, stocks=[], random_price=False, times=None):
+        """ Wrap existing arrays without copying them. times are parsed from dates if not given
+        """
+        market = cls.__new__(cls)
+        market._setup(list(dates), list(symbols), prices, stocks, random_price, times)
+        market.data_file = None
+        return market
+
+    def _setup(self, dates, symbols, prices, stocks, random_price, times=None):
+        assert prices.shape == (len(dates), len(symbols), len(FIELDS)), \
+                f"Prices shape {prices.shape} does not match dates, symbols and fields"
+        self.random_price = random_price
+        self.dates = dates
+        if (times is None):
+            times = time_axis(dates)[0]
+        self.times = times
+        self.session_date = times // 86400
+        self.time_of_day = times % 86400
+        self.symbols = symbols
+        self.prices = prices
+        self.date_index = {day: i for i, day in enumerate(self.dates)}
+        self.symbol_index = {stock: i for i, stock in enumerate(self.symbols)}
+        self.data = MarketSnapshots(self)
+        self.stocks = stocks
+        self.version = next(_versions)
+
+    def set_stocks(self, stocks):
+        self.stocks = stocks
+
+    def slice(self, start=0, end=None):
+        """ Market over ticks start to end. The prices are a view, not a copy
+        """
+        return StockMarketArray.from_arrays(self.dates[start:end], self.symbols, self.prices[start:end],
+                                            self.stocks, self.random_price, self.times[start:end])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        for current_day in self.dates:
+            yield self.snapshot(current_day)
+
+    @property
+    def nbytes(self):
+        """ Size of the price array. Indexes not included
+        """
+        return self.prices.nbytes
+
+    def field(self, name):
+        """ (time x symbol) view of a single field
+        """
+        return self.prices[:, :, FIELDS.index(name)]
+
+    def tick(self, current_date):
+        """ (symbol x field) view of a single timestamp
+        """
+        return self.prices[self.date_index[current_date]]
+
+    def snapshot(self, current_date, all_stocks=False):
+        """
+        Same {company: {open: close: ...}} dictionary StockMarketDict
+        hands out for a timestamp. Only companies with data are included.
+        Limited to self.stocks unless all_stocks or no stocks are set
+        """
+        row = self.tick(current_date)
+        if (all_stocks or self.stocks == []):
+            columns = np.flatnonzero(~np.isnan(row).all(axis=1))
+        else:
+            columns = [self.symbol_index[stock] for stock in self.stocks if stock in self.symbol_index]
+            columns = [s for s in columns if not np.isnan(row[s]).all()]
+
+        snapshot = {}
+        for s in columns:
+            values = row[s].tolist()
+            snapshot[self.symbols[s]] = {field: (None if v != v else v) for field, v in zip(FIELDS, values)}
+        return snapshot
+
+    def _lookup(self, stock, current_date):
+        """ Row and column of a timestamp and company or None
+        """
+        t = self.date_index.get(current_date)
+        s = self.symbol_index.get(stock)
+        if ((t == None) or (s == None)):
+            return None
+        return t, s
+
+    def _price(self, t, s, field):
+        price = float(self.prices[t, s, field])
+        if (price != price):
+            return None
+        return price
+
+    def _random_price(self, t, s):
+        high = self._price(t, s, HIGH)
+        low = self._price(t, s, LOW)
+        if ((high == None) or (low == None)):
+            return None
+        r = random.random()
+        return low * r + high * (1-r)
+
+    def sell(self, stock, current_date):
+        """
+        Selling will be uniform random roll over high low value
+        """
+        location = self._lookup(stock, current_date)
+        if (location == None):
+            return None
+
+        if (self.random_price):
+            return self._random_price(*location)
+        return self._price(*location, OPEN)
+
+    def buy(self, stock, current_date):
+        location = self._lookup(stock, current_date)
+        if (location == None):
+            return None
+
+        if (self.random_price):
+            return self._random_price(*location)
+        return self._price(*location, OPEN)
+
+    def current_price(self, stock, current_date):
+        location = self._lookup(stock, current_date)
+        if (location == None):
+            return None
+        return self._price(*location, OPEN)
+
+def load_market(data_file, stocks=[], random_price=False):
+    """
+    Store directories are opened with StockMarketArray. Anything
+    else is taken to be a StockMarketDict pickle
+    """
+    if os.path.isdir(data_file):
+        return StockMarketArray.from_store(data_file, stocks=stocks, random_price=random_price)
+    return StockMarketDict(stocks=stocks, random_price=random_price, data_file=data_file)
 
 class StockMarketSQL:
+    """
+    Daily prices from the stocks database.
+
+    With prefetch every trading day's full cross section is loaded with
+    one query, window_days calendar days at a time, and kept in a cache of
+    at most cache_days days. Lookups for single tickers are then
+    served from memory. Without prefetch every lookup is its own query.
 
-    def __init__(self, table="dailyTicker"):
-        assert os.environ.get('DB_USER'), "Set mysql database user DB_USER"
-        assert os.environ.get('DB_PASS'), "Set mysql database password DB_PASS"
-        self.con = mysql.connector.connect(user=os.environ.get('DB_USER'), database="stocks", password=os.enviorn.get('DB_PASS'))
-        self.cur = self.con.cursor()
+    pool is a database.ConnectionPool. Defaults to the mysql database,
+    database.sqlite_pool can stand in for it.
+    """
+
+    def __init__(self, table="dailyTicker", pool=None, prefetch=True, window_days=7, cache_days=64):
+        assert cache_days >= window_days, "Cache must hold at least one window of days"
+        self.pool = pool or mysql_pool()
         self.table = table
+        self.prefetch = prefetch
+        self.window_days = window_days
+        self.cache_days = cache_days
+        # {date: {company: (open, high, low)}}. Empty dictionary for days without data
+        self.cache = OrderedDict()
         self.current_date = date(1999,11,1)
         self.end_date = date(2020,8,4)
 
@@ -102,8 +333,7 @@ class StockMarketSQL:
         return day_str + " 00:00:00"
 
     def available_stocks(self):
-        self.cur.execute(f"SELECT company FROM stockCreation WHERE date <= \"{self._format_date}\"")
-        results = self.cur.fetchall()
+        results = self.pool.fetchall("SELECT company FROM stockCreation WHERE date <= ?", (self._format_date,))
         results = self._unwrap_results(results)
         return results
 
@@ -123,12 +353,48 @@ class StockMarketSQL:
             # Monday 0, ... Sat 5, Sun 6
             self.advance(1)
 
+    def _load_window(self, first_day):
+        """ One query for the cross sections of window_days days starting at first_day
+        """
+        days = [first_day + timedelta(days=i) for i in range(self.window_days)]
+        window = {day: {} for day in days}
+        end_day = days[-1] + timedelta(days=1)
+        results = self.pool.fetchall(f"SELECT date, company, open, high, low FROM {self.table} "
+                                      "WHERE date >= ? AND date < ?",
+                                      (first_day.strftime("%Y-%m-%d"), end_day.strftime("%Y-%m-%d")))
+        for day, company, open_price, high, low in results:
+            # mysql gives datetimes and sqlite strings
+            day = date.fromisoformat(str(day)[:10])
+            window[day][company] = (open_price, high, low)
+
+        for day in days:
+            self.cache[day] = window[day]
+        while len(self.cache) > self.cache_days:
+            self.cache.popitem(last=False)
+
+    def _cross_section(self):
+        """ {company: (open, high, low)} for the current day
+        """
+        if self.current_date not in self.cache:
+            self._load_window(self.current_date)
+        self.cache.move_to_end(self.current_date)
+        return self.cache[self.current_date]
+
+    def _lookup(self, ticker):
+        """ (open, high, low) of ticker today or None if there is no row
+        """
+        if (self.prefetch):
+            return self._cross_section().get(ticker)
+        results = self.pool.fetchall(f"SELECT open, high, low FROM {self.table} WHERE company=? AND date=?",
+                                     (ticker, self._format_date))
+        if (len(results) == 0):
+            return None
+        return results[0]
+
     def current_price(self, ticker):
-        self.cur.execute(f"SELECT open FROM {self.table} WHERE company=\"{ticker}\" AND date=\"{self._format_date}\"")
-        results = self.cur.fetchall()
-        results = self._unwrap_results(results)
+        results = self._lookup(ticker)
         # Check if there is some holiday buy checking if any stocks have a price
-        if (len(results) == 0):
+        if (results == None):
             # is_holiday will advance the current day is no other stocks have prices
             if (self.is_holiday()):
                 return self.current_price(ticker)
@@ -143,10 +409,12 @@ class StockMarketSQL:
         See if any stock has a price for that day. If not we call
         self.advance to move on.
         """
-        self.cur.execute(f"SELECT open FROM {self.table} WHERE date=\"{self._format_date}\"")
-        results = self.cur.fetchall()
-        results = self._unwrap_results(results)
-        if len(results) == 0:
+        if (self.prefetch):
+            holiday = len(self._cross_section()) == 0
+        else:
+            results = self.pool.fetchall(f"SELECT 1 FROM {self.table} WHERE date=? LIMIT 1", (self._format_date,))
+            holiday = len(results) == 0
+        if (holiday):
             self.advance()
             return True
         return False
@@ -155,37 +423,71 @@ class StockMarketSQL:
         """
         Selling will be uniform random roll over high low value
         """
-
-        self.cur.execute(f"SELECT high,low FROM {self.table} WHERE company=\"{ticker}\" AND date=\"{self._format_date}\"")
-        results = self.cur.fetchall()
-        if (len(results) == 0):
+        results = self._lookup(ticker)
+        if (results == None):
             if (self.is_holiday()): # Is holiday will advance the current day if true
                 return self.sell(ticker)
             else:
                 return None
-        assert len(results) == 1, f"Selling no results found for {ticker} on {self._format_date}"
-        high, low = results[0]
+        _, high, low = results
         r = random.random()
         buy_price = low * r + high * (1-r)
         return buy_price
 
 class StockMarketDataFrame:
+    """
+    Daily data from a long format csv (timestamp, company, open, ...)
+    Rows are sorted by day then company once when loading, so a day is
+    a contiguous block of rows found with a dictionary lookup and a
+    company is found in its day block with a binary search.
+    """
 
     def __init__(self, data_file="daily_all.csv"):
-        self.dataframe = pd.read_csv(data_file)
+        df = pd.read_csv(data_file)
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.normalize()
+        df = df.sort_values(["timestamp", "company"], kind="stable").reset_index(drop=True)
+        self.dataframe = df
         self.data_file = data_file
         self.current_date = date(1999,11,1)
         self.end_date = date(2020,8,4)
 
+        self.companies = df["company"].to_numpy()
+        self.open = df["open"].to_numpy(dtype=np.float64)
+        self.high = df["high"].to_numpy(dtype=np.float64)
+        self.low = df["low"].to_numpy(dtype=np.float64)
+
+        # {date: (first row, last row + 1)}
+        days = df["timestamp"].to_numpy().astype("datetime64[D]")
+        starts = np.flatnonzero(np.concatenate([[True], days[1:] != days[:-1]])) if len(days) else np.array([], dtype=int)
+        ends = np.append(starts[1:], len(days))
+        self.day_rows = {day: (int(start), int(end)) for day, start, end in
+                            zip(days[starts].astype(object), starts, ends)}
+
     @property
     def _format_date(self):
         day_str = self.current_date.strftime("%Y-%m-%d")
         return day_str
 
+    def cross_section(self, day=None):
+        """
+        All rows for a day (default current day) sorted by company.
+        Empty if there is no data for that day
+        """
+        start, end = self.day_rows.get(day or self.current_date, (0, 0))
+        return self.dataframe.iloc[start:end]
+
+    def _row(self, ticker):
+        """ Row of ticker on the current day or None
+        """
+        start, end = self.day_rows.get(self.current_date, (0, 0))
+        row = start + np.searchsorted(self.companies[start:end], ticker)
+        if (row < end) and (self.companies[row] == ticker):
+            return row
+        return None
+
     def available_stocks(self):
-        results = self.dataframe.loc[lambda x:
-                        x["timestamp"] == self._format_date]["company"]
-        return results.values
+        start, end = self.day_rows.get(self.current_date, (0, 0))
+        return self.companies[start:end]
 
     def advance(self, num=1):
         if (self.current_date >= self.end_date):
@@ -200,19 +502,17 @@ class StockMarketDataFrame:
             self.advance(1)
 
     def current_price(self, ticker):
-        results =  self.dataframe.loc[ lambda x:
-                                    (x["timestamp"] == self._format_date) &
-                                    (x["company"] == ticker)]["open"]
+        row = self._row(ticker)
 
         # Check if there is some holiday buy checking if any stocks have a price
-        if (results.empty):
+        if (row == None):
             # is_holiday will advance the current day is no other stocks have prices
             if (self.is_holiday()):
                 return self.current_price(ticker)
             else:
                 return None
 
-        return results.values[0]
+        return self.open[row]
 
     def is_holiday(self):
         """
@@ -220,10 +520,7 @@ class StockMarketDataFrame:
         See if any stock has a price for that day. If not we call
         self.advance to move on.
         """
-        results =  self.dataframe.loc[ lambda x:
-                                    (x["timestamp"] == self._format_date)]["open"]
-
-        if (results.empty):
+        if (self.current_date not in self.day_rows):
             print(f"Found holiday {self.current_date}")
             self.advance()
             return True
@@ -233,17 +530,13 @@ class StockMarketDataFrame:
         """
         Selling will be uniform random roll over high low value
         """
-        results =  self.dataframe.loc[ lambda x:
-                                    (x["timestamp"] == self._format_date) &
-                                    (x["company"] == ticker)]
-        if (results.empty):
+        row = self._row(ticker)
+        if (row == None):
             if (self.is_holiday()): # Is holiday will advance the current day if true
                 return self.sell(ticker)
             else:
                 return None
-        assert len(results) == 1, f"Selling no results found for {ticker} on {self._format_date}"
-        high, low = results["high"], results["low"]
+        high, low = self.high[row], self.low[row]
         r = random.random()
         buy_price = low * r + high * (1-r)
-        return buy_price.values[0]
-
+        return buy_price
@@ -0,0 +1,352 @@
+"""
+Risk metrics of an equity curve, the portfolio values of a backtest.
+
+The functions work on arrays once a backtest is done. Everything except
+drawdown and summary works along the last axis, so a (runs x time)
+matrix of the values of many sweep runs is evaluated in one go.
+StreamingMetrics gets the same numbers fed one value at a time at O(1)
+per tick, which is how Executor.run keeps them.
+
+Returns are taken between session closes, the last value of each
+session, and annualized with periods_per_year (252 trading days).
+Metrics that cannot be worked out (too few returns, no drawdown, no
+trades) are NaN. Spreads and drawdowns below TINY count as none, they
+are rounding errors of flat curves and would give arbitrary ratios.
+"""
+import copy
+import math
+from collections import deque
+
+import numpy as np
+
+TINY = 1e-12
+
+class DrawDown:
+    """
+    Calulates and stored the maximum drawdown time and value.
+    Defined as the time between the newest peak value and until it
+    crosses into a new peak value.
+    The high will then be the difference between the peak and the lowest for
+    the given time frame
+    Times are seconds since epoch, like market.times
+    """
+
+    def __init__(self):
+        self.last_peak = 0
+        self.peak_time = None
+        self.max_time = 0
+        self.max_height = 0
+
+    def calc(self, value, time):
+        if (value > self.last_peak):
+            self.last_peak = value
+            self.peak_time = time
+
+        elif (value < self.last_peak):
+
+            if (self.peak_time != None):
+                self.max_time = max(self.max_time, (time - self.peak_time) // 86400)
+
+            if (self.max_height < self.last_peak - value):
+                self.max_height = self.last_peak - value
+
+class RunningStats:
+    """ Count, mean, variance (Welford), min and max of a stream of values
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    @property
+    def std(self):
+        if (self.count < 2):
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def confidence_interval(self, z=1.96):
+        """ Normal approximation interval of the mean, 95% by default
+        """
+        half = z * self.std / math.sqrt(max(self.count, 1))
+        return self.mean - half, self.mean + half
+
+def _scalar(x):
+    """ Plain floats for single runs, arrays for many
+    """
+    if (np.ndim(x) == 0):
+        return float(x)
+    return x
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        usable = denominator > TINY
+        return np.where(usable, numerator / np.where(usable, denominator, 1), np.nan)
+
+def _nan(x):
+    return _scalar(np.full(np.shape(x)[:-1], np.nan))
+
+def drawdown(values, times):
+    """
+    Same numbers as DrawDown fed values in order
+        values: portfolio values
+        times: seconds since epoch of each value
+
+    Returns:
+        max_height, max_time in whole days
+    """
+    if (len(values) == 0):
+        return 0, 0
+    peak = np.maximum.accumulate(np.concatenate([[0.0], values]))[:-1]
+    index = np.arange(len(values))
+    new_peak = values > peak
+    peak_index = np.maximum.accumulate(np.where(new_peak, index, -1))
+    peak_before = np.concatenate([[-1], peak_index[:-1]])
+    below = values < peak
+    if not below.any():
+        return 0, 0
+    max_height = np.max(peak[below] - values[below])
+    # Before the first peak there is no date to count from
+    dated = below & (peak_before >= 0)
+    seconds = times[dated] - times[peak_before[dated]]
+    return max_height, int(np.max(seconds // 86400, initial=0))
+
+def max_drawdown(values):
+    """ Largest fall from a peak as a fraction of the peak
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if (values.shape[-1] == 0):
+        return _nan(values)
+    peak = np.maximum.accumulate(values, axis=-1)
+    return _scalar(np.max(1 - values / peak, axis=-1))
+
+def session_closes(values, session_date):
+    """ Last value of each session, session_date like market.session_date
+    """
+    session_date = np.asarray(session_date)
+    last = np.flatnonzero(np.append(session_date[1:] != session_date[:-1], True)) if len(session_date) else []
+    return np.asarray(values, dtype=np.float64)[..., last]
+
+def period_returns(values):
+    """ Simple returns between consecutive values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return values[..., 1:] / values[..., :-1] - 1
+
+def volatility(returns, periods_per_year=252):
+    """ Annualized standard deviation of returns
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if (returns.shape[-1] < 2):
+        return _nan(returns)
+    return _scalar(returns.std(axis=-1, ddof=1) * math.sqrt(periods_per_year))
+
+def sharpe(returns, periods_per_year=252, risk_free=0.0):
+    """ Annualized Sharpe ratio. risk_free is per period
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if (returns.shape[-1] < 2):
+        return _nan(returns)
+    excess = returns.mean(axis=-1) - risk_free
+    return _scalar(_ratio(excess, returns.std(axis=-1, ddof=1)) * math.sqrt(periods_per_year))
+
+def sortino(returns, periods_per_year=252, target=0.0):
+    """ Annualized Sortino ratio, only returns below target count as risk
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if (returns.shape[-1] == 0):
+        return _nan(returns)
+    downside = np.sqrt(np.mean(np.minimum(returns - target, 0)**2, axis=-1))
+    return _scalar(_ratio(returns.mean(axis=-1) - target, downside) * math.sqrt(periods_per_year))
+
+def calmar(returns, values, periods_per_year=252):
+    """ Annualized mean return over the max drawdown of values
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if (returns.shape[-1] == 0):
+        return _nan(returns)
+    return _scalar(_ratio(returns.mean(axis=-1) * periods_per_year, np.asarray(max_drawdown(values))))
+
+def rolling_volatility(returns, window=20, periods_per_year=252):
+    """
+    Annualized standard deviation of each window of returns, ending at
+    every return. NaN until a window is full
+    """
+    assert window > 1, "Window needs at least two returns"
+    returns = np.asarray(returns, dtype=np.float64)
+    result = np.full(returns.shape, np.nan)
+    if (returns.shape[-1] < window):
+        return result
+    zero = np.zeros(returns.shape[:-1] + (1,))
+    sums = np.concatenate([zero, np.cumsum(returns, axis=-1)], axis=-1)
+    squares = np.concatenate([zero, np.cumsum(returns**2, axis=-1)], axis=-1)
+    total = sums[..., window:] - sums[..., :-window]
+    total_squares = squares[..., window:] - squares[..., :-window]
+    variance = np.maximum(total_squares - total**2 / window, 0) / (window - 1)
+    result[..., window - 1:] = np.sqrt(variance * periods_per_year)
+    return result
+
+def turnover(traded, values):
+    """ Value of everything bought and sold over the mean portfolio value
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if (values.shape[-1] == 0):
+        return _nan(values)
+    return _scalar(_ratio(np.sum(traded, axis=-1), values.mean(axis=-1)))
+
+def hit_rate(profits):
+    """ Fraction of closed trades with a profit
+    """
+    profits = np.asarray(profits, dtype=np.float64)
+    if (profits.shape[-1] == 0):
+        return _nan(profits)
+    return _scalar(np.mean(profits > 0, axis=-1))
+
+def summary(values, times, profits=(), traded=(), periods_per_year=252, risk_free=0.0):
+    """
+    Every metric of one run
+        values: portfolio values in time order
+        times: seconds since epoch of each value
+        profits: profit of every closed trade
+        traded: value of every buy and sell
+
+    Returns:
+        dict of the metrics
+    """
+    values = np.asarray(values, dtype=np.float64)
+    times = np.asarray(times, dtype=np.int64)
+    returns = period_returns(session_closes(values, times // 86400))
+    max_height, max_time = drawdown(values, times)
+    return {"max_drawdown": float(max_height), "max_drawdown_days": int(max_time),
+            "max_drawdown_pct": 100 * max_drawdown(values),
+            "volatility": volatility(returns, periods_per_year),
+            "sharpe": sharpe(returns, periods_per_year, risk_free),
+            "sortino": sortino(returns, periods_per_year),
+            "calmar": calmar(returns, values, periods_per_year),
+            "turnover": turnover(traded, values), "hit_rate": hit_rate(profits)}
+
+class StreamingMetrics:
+    """
+    Same numbers as summary() fed one value at a time. An update costs
+    the same whatever the number of ticks seen: running statistics of the
+    session returns, the peak, and running sums over a window of the
+    latest returns for rolling_volatility
+    """
+
+    def __init__(self, periods_per_year=252, risk_free=0.0, window=20):
+        assert window > 1, "Window needs at least two returns"
+        self.periods_per_year = periods_per_year
+        self.risk_free = risk_free
+        self.drawdown = DrawDown()
+        self.returns = RunningStats()
+        self.downside = 0.0
+        self.window = deque(maxlen=window)
+        self.window_sum = 0.0
+        self.window_squares = 0.0
+        self.peak = -math.inf
+        self.max_drawdown = 0.0
+        self.count = 0
+        self.value_sum = 0.0
+        self.traded = 0.0
+        self.trades = 0
+        self.wins = 0
+        # Session of the latest value and the close of the session before it
+        self.session = None
+        self.session_value = None
+        self.previous_close = None
+
+    def update(self, value, time):
+        """ Portfolio value at time, seconds since epoch
+        """
+        self.drawdown.calc(value, time)
+        self.peak = max(self.peak, value)
+        self.max_drawdown = max(self.max_drawdown, 1 - value / self.peak)
+        self.count += 1
+        self.value_sum += value
+
+        session = time // 86400
+        if (session != self.session):
+            if (self.session_value != None):
+                if (self.previous_close != None):
+                    self._add_return(self.session_value / self.previous_close - 1)
+                self.previous_close = self.session_value
+            self.session = session
+        self.session_value = value
+
+    def _add_return(self, r):
+        self.returns.add(r)
+        self.downside += min(r, 0)**2
+        if (len(self.window) == self.window.maxlen):
+            old = self.window[0]
+            self.window_sum -= old
+            self.window_squares -= old**2
+        self.window.append(r)
+        self.window_sum += r
+        self.window_squares += r**2
+
+    def add_fill(self, traded):
+        """ Value of a buy or sell
+        """
+        self.traded += traded
+
+    def add_trade(self, profit):
+        """ Profit of a closed trade
+        """
+        self.trades += 1
+        if (profit > 0):
+            self.wins += 1
+
+    @property
+    def rolling_volatility(self):
+        """
+        Annualized volatility of the last window of session returns.
+        The latest session counts as closed, like in summary()
+        """
+        total, squares, n = self.window_sum, self.window_squares, len(self.window)
+        if (self.previous_close != None):
+            r = self.session_value / self.previous_close - 1
+            if (n == self.window.maxlen):
+                old = self.window[0]
+                total -= old
+                squares -= old**2
+                n -= 1
+            total += r
+            squares += r**2
+            n += 1
+        if (n < self.window.maxlen):
+            return math.nan
+        variance = max(squares - total**2 / n, 0) / (n - 1)
+        return math.sqrt(variance * self.periods_per_year)
+
+    def summary(self):
+        returns, downside = self.returns, self.downside
+        # The latest session counts as closed
+        if (self.previous_close != None):
+            r = self.session_value / self.previous_close - 1
+            returns = copy.copy(returns)
+            returns.add(r)
+            downside += min(r, 0)**2
+
+        root = math.sqrt(self.periods_per_year)
+        std = returns.std if (returns.count > 1) else math.nan
+        downside = math.sqrt(downside / returns.count) if (returns.count > 0) else math.nan
+        mean = returns.mean if (returns.count > 0) else math.nan
+        ratio = lambda a, b: a / b if (b > TINY) else math.nan
+        return {"max_drawdown": float(self.drawdown.max_height), "max_drawdown_days": int(self.drawdown.max_time),
+                "max_drawdown_pct": 100 * self.max_drawdown if (self.count > 0) else math.nan,
+                "volatility": std * root,
+                "sharpe": ratio(mean - self.risk_free, std) * root,
+                "sortino": ratio(mean, downside) * root,
+                "calmar": ratio(mean * self.periods_per_year, self.max_drawdown),
+                "turnover": ratio(self.traded, self.value_sum / self.count) if (self.count > 0) else math.nan,
+                "hit_rate": self.wins / self.trades if (self.trades > 0) else math.nan}
@@ -0,0 +1,137 @@
+"""
+Monte Carlo baselines. Many backtests of a random agent spread over a
+process pool sharing the market's prices (sweep.SharedMarket). Every
+run gets its own random stream spawned from one seed, so results are
+the same whatever the number of processes. The final gains are folded
+into running statistics as runs finish, nothing of a run is kept
+besides its gain.
+"""
+import math
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from agent import AgentRandom
+from market import StockMarketArray
+from metrics import RunningStats
+from sweep import SharedMarket, _init_worker, _backtest, backtest_agent
+
+class P2Quantile:
+    """
+    Streaming estimate of the p quantile with the P-squared algorithm
+    (Jain and Chlamtac 1985). Keeps five markers instead of the values.
+    Exact until five values have been seen
+    """
+
+    def __init__(self, p):
+        assert 0 < p < 1, "Quantile must be between 0 and 1"
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.increments = [0, p/2, p, (1 + p)/2, 1]
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if (len(q) < 5):
+            q.append(x)
+            q.sort()
+            return
+
+        if (x < q[0]):
+            q[0] = x
+            k = 0
+        elif (x >= q[4]):
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards where they should be
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if ((d >= 1) and (n[i + 1] - n[i] > 1)) or ((d <= -1) and (n[i - 1] - n[i] < -1)):
+                d = 1 if (d > 0) else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not (q[i - 1] < height < q[i + 1]):
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    @property
+    def value(self):
+        if (len(self.heights) == 0):
+            return math.nan
+        if (self.positions[4] == 5):
+            return float(np.quantile(self.heights, self.p))
+        return self.heights[2]
+
+class GainDistribution:
+    """ Running statistics and quantiles of final gains
+    """
+
+    def __init__(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        self.stats = RunningStats()
+        self.quantiles = {p: P2Quantile(p) for p in quantiles}
+
+    def add(self, gain):
+        self.stats.add(gain)
+        for quantile in self.quantiles.values():
+            quantile.add(gain)
+
+    def summary(self):
+        ci_low, ci_high = self.stats.confidence_interval()
+        summary = {"runs": self.stats.count, "mean": self.stats.mean, "std": self.stats.std,
+                   "ci_low": ci_low, "ci_high": ci_high, "min": self.stats.min, "max": self.stats.max}
+        for p, quantile in self.quantiles.items():
+            summary[f"q{round(100*p):02d}"] = quantile.value
+        return summary
+
+def run_monte_carlo(market, agent_class=AgentRandom, num_runs=1000, seed=0, stocks=None, params=None,
+                    cash=10000, close_time="18:30:00", processes=None, report_every=100):
+    """
+    Backtest num_runs agent_class(stocks, seed=..., **params) agents.
+    Run i always gets the i-th stream spawned from seed.
+
+    Returns:
+        summary dict of the final gain distribution
+    """
+    if not isinstance(market, StockMarketArray):
+        market = StockMarketArray.from_dict(market.data)
+    streams = np.random.SeedSequence(seed).spawn(num_runs)
+    params = {} if (params == None) else params
+    jobs = [(agent_class, dict(params, seed=stream), stocks, cash, close_time) for stream in streams]
+    distribution = GainDistribution()
+    start = time.perf_counter()
+    if (processes == 1):
+        results = (backtest_agent(market, *job) for job in jobs)
+        shared = None
+    else:
+        shared = SharedMarket(market)
+        workers = Pool(processes, initializer=_init_worker, initargs=(shared,))
+        # In order so the quantile estimates do not depend on timing
+        results = workers.imap(_backtest, jobs, chunksize=max(1, num_runs // 64))
+
+    try:
+        for i, row in enumerate(results):
+            distribution.add(row["gain"])
+            if (report_every) and ((i + 1) % report_every == 0):
+                summary = distribution.summary()
+                print(f"{i + 1} runs, mean gain {summary['mean']:.3f} "
+                      f"({summary['ci_low']:.3f}, {summary['ci_high']:.3f}), median {summary['q50']:.3f}")
+    finally:
+        if (shared != None):
+            workers.close()
+            workers.join()
+            shared.close()
+
+    summary = distribution.summary()
+    print(f"Finished {summary['runs']} runs in {time.perf_counter() - start:.1f}s")
+    return summary
@@ -0,0 +1,85 @@
+"""
+Parity checks between the ways of running a backtest. Each runs the
+same agent twice on a market and asserts the results are the same.
+Used by the tests (tests/) and benchmarks.py.
+"""
+from time import perf_counter
+
+import numpy as np
+
+from backtest import run_backtest
+from main import Executor
+from portfolio import Portfolio
+
+def check_replay_parity(market, make_agent, stocks, cash=10000, time=True):
+    """
+    Run a backtest streaming through decide and again replaying
+    compute_signals and check the two make the same decisions and trades.
+    make_agent(stocks) gives a fresh agent.
+
+    Returns:
+        seconds taken streaming, seconds taken replaying (signals included)
+    """
+    start = perf_counter()
+    streamed = Executor(make_agent(stocks), market, Portfolio(cash=cash), stocks, time=time)
+    streamed.run()
+    stream_seconds = perf_counter() - start
+
+    start = perf_counter()
+    agent = make_agent(stocks)
+    replayed = Executor(agent, market, Portfolio(cash=cash), stocks, time=time)
+    replayed.run(signals=agent.compute_signals(market))
+    replay_seconds = perf_counter() - start
+
+    decided = lambda e: [(t, e.decision_tracker.symbols[s], a) for t, s, a in
+                         zip(e.decision_tracker.ticks, e.decision_tracker.symbol_rows, e.decision_tracker.actions)]
+    assert decided(streamed) == decided(replayed), "Decisions differ"
+    trades = lambda e: [(h.stock, h.buy_date, h.buy_price, h.sell_date, h.sell_price) for h in e.portfolio.historical]
+    assert trades(streamed) == trades(replayed), "Trades differ"
+    assert np.array_equal(streamed.portfolio_tracker.gain, replayed.portfolio_tracker.gain), "Values differ"
+    print(f"{len(streamed.decision_tracker)} decisions and {streamed.portfolio.trade_count} trades the same. "
+          f"Streaming {stream_seconds:.2f}s replay {replay_seconds:.2f}s")
+    return stream_seconds, replay_seconds
+
+def check_backtest_parity(market, make_agent, stocks, cash=10000, close_time="18:30:00", mark_to_market=False):
+    """
+    Run a backtest with the Executor and again with the vectorized
+    backtest.run_backtest and check trades, tracked values, drawdown and metrics
+    are the same. make_agent(stocks) gives a fresh agent.
+
+    Returns:
+        seconds taken by the Executor, seconds taken vectorized (signals included)
+    """
+    start = perf_counter()
+    portfolio = Portfolio(cash=cash, mark_to_market=mark_to_market)
+    executor = Executor(make_agent(stocks), market, portfolio, stocks, time=True, close_time=close_time)
+    executor.run()
+    executor_seconds = perf_counter() - start
+
+    start = perf_counter()
+    agent = make_agent(stocks)
+    result = run_backtest(agent.compute_signals(market), market, cash=cash, close_time=close_time,
+                          mark_to_market=mark_to_market)
+    vector_seconds = perf_counter() - start
+
+    holdings = list(executor.portfolio.historical) + executor.portfolio.active
+    expected = sorted((h.stock, h.buy_date, h.buy_price, h.sell_date, h.sell_price) for h in holdings)
+    dated = lambda t: None if (t < 0) else market.dates[t]
+    price = lambda p: None if (p != p) else p
+    found = sorted((result.symbols[s], market.dates[buy_tick], buy_price, dated(sell_tick), price(sell_price))
+                   for s, buy_tick, buy_price, sell_tick, sell_price in result.trades.tolist())
+    assert expected == found, "Trades differ"
+
+    tracker = executor.portfolio_tracker
+    assert np.array_equal(tracker.ticks, np.flatnonzero(result.tracked)), "Tracked days differ"
+    assert np.allclose(tracker.gain, result.gain[result.tracked], rtol=0, atol=1e-9), "Tracked values differ"
+    assert np.allclose(tracker.equity, result.value[result.tracked], rtol=0, atol=1e-9), "Tracked values differ"
+    assert np.allclose(tracker.cash, result.cash[result.tracked], rtol=0, atol=1e-9), "Tracked cash differs"
+    assert np.isclose(executor.drawdown.max_height, result.max_height, rtol=0, atol=1e-9), "Drawdown differs"
+    assert executor.drawdown.max_time == result.max_time, "Drawdown time differs"
+    streamed, vectorized = executor.metrics.summary(), result.metrics()
+    for name, value in streamed.items():
+        assert np.isclose(value, vectorized[name], rtol=1e-9, atol=1e-12, equal_nan=True), f"{name} differs"
+    print(f"{len(found)} trades and {len(tracker)} tracked values the same. "
+          f"Executor {executor_seconds:.2f}s vectorized {vector_seconds:.3f}s")
+    return executor_seconds, vector_seconds
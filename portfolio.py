@@ -1,70 +1,203 @@
+from collections import deque
+
+import numpy as np
+
+# Records of sold lots. Symbols are numbers into Portfolio.symbols, fills
+# are dated by tick, numbers into Portfolio.dates
+TRADE = np.dtype([("symbol", np.int32), ("quantity", np.int64), ("buy_price", np.float64),
+                  ("buy_tick", np.int64), ("sell_price", np.float64), ("sell_tick", np.int64)])
+
 class Portfolio:
 
     """
     Class will keep track of results of trades and keep log
     of what has been traded when.
 
+    Each symbol gets a row in per symbol lists of quantity held, cost and
+    latest price, found through symbol_index. Shares are bought in lots
+    that are sold first in first out, every sale of a lot is appended to
+    the preallocated trades array. Buying, selling and checking what is
+    held do not depend on how many trades there have been.
+
+    Days of fills are ticks, the number of the timestamp in the market.
+    The Executor sets dates to the market's dates so the Holding views
+    (historical, active) show the timestamps. Without dates they show
+    the ticks.
+
+    Cash, the cost of the holdings and realized profits are running totals
+    updated on every trade, so valuing the portfolio does not depend on
+    how many trades there have been.
+    With mark_to_market holdings are valued at the latest prices given to
+    mark() instead of what was paid for them.
     """
-    def __init__(self, cash):
-        self.active = []
-        self.historical = []
-        self.equity = 0
+    def __init__(self, cash, mark_to_market=False, capacity=1024):
         self.cash = cash
         self.initial_cash = cash
-        self.value_over_time = {}
-
-    def add(self, stock, price, day, quantity):
-        # TODO use quantity for cash
-        if (price < self.cash):
-            self.active.append(Holding(stock, price, day, quantity))
-            self.cash -= price
-            self.value_over_time[day] = self.total_value
+        self.mark_to_market = mark_to_market
+        # Running totals
+        self.cost_basis = 0.0
+        self.realized = 0.0
+        self.market_value = 0.0
+
+        # Symbols are kept once and referred to by number
+        self.symbols = []
+        self.symbol_index = {}
+        # Timestamps of the ticks, e.g. market.dates
+        self.dates = None
+
+        # Per symbol rows
+        self.quantity = []
+        self.cost = []
+        self.mark_price = []
+        # [quantity, price, tick] of the lots of each symbol, oldest first
+        self.lots = []
+        # Rows of the symbols held, in the order they were bought
+        self.held = {}
+
+        self.trades = np.zeros(capacity, dtype=TRADE)
+        self.trade_count = 0
+
+    def _symbol(self, stock):
+        row = self.symbol_index.get(stock)
+        if (row == None):
+            row = len(self.symbols)
+            self.symbols.append(stock)
+            self.quantity.append(0)
+            self.cost.append(0.0)
+            self.mark_price.append(0.0)
+            self.symbol_index[stock] = row
+            self.lots.append(deque())
+        return row
+
+    def date(self, tick):
+        """ Timestamp of a tick, the tick itself without dates
+        """
+        if (self.dates is None):
+            return tick
+        return self.dates[tick]
+
+    def add(self, stock, price, tick, quantity):
+        cost = price * quantity
+        if (cost < self.cash):
+            row = self._symbol(stock)
+            self.lots[row].append([quantity, price, tick])
+            # Everything held of the stock is valued at the newest price
+            self.market_value += self.quantity[row] * (price - self.mark_price[row]) + cost
+            self.mark_price[row] = price
+            self.quantity[row] += quantity
+            self.cost[row] += cost
+            self.held[row] = None
+            self.cash -= cost
+            self.cost_basis += cost
+
+    def holds(self, stock):
+        row = self.symbol_index.get(stock)
+        return (row != None) and (row in self.held)
 
     @property
     def current_stocks(self):
-        return list(map(lambda h: h.stock, self.active))
+        return [self.symbols[row] for row in self.held]
+
+    def mark(self, market, day):
+        """
+        Value the holdings at the market's current prices. Holdings
+        without a price keep the last one they had
+        """
+        for row in self.held:
+            price = market.current_price(self.symbols[row], day)
+            if (price != None):
+                self.mark_price[row] = price
+        self.market_value = sum([self.quantity[row] * self.mark_price[row] for row in self.held])
 
     @property
     def total_value(self):
-        cash_reserves = sum([h.profit for h in self.historical])
-        equity = sum([a.buy_price for a in self.active])
-        return (cash_reserves + equity + self.cash)
+        if (self.mark_to_market):
+            return self.cash + self.market_value
+        return self.cash + self.cost_basis
 
     @property
     def total_gain(self):
-        cash_reserves = sum([h.profit for h in self.historical])
-        equity = sum([a.buy_price for a in self.active])
-        return 100*((cash_reserves + equity + self.cash) - self.initial_cash) / self.initial_cash
-
-    def move_completed(self):
-        active   = [h for h in self.active if h.sold==False]
-        finished = [h for h in self.active if h.sold==True]
-        self.active = active
-        self.historical.extend(finished)
-
-    def sold(self, stock, price, day, quantity):
-        for holding in self.active:
-            if (holding.stock == stock):
-                # If selling less make new holding
-                # and sell that then update old to new amount
-                if (holding.quantity > quantity):
-                    holding.quantity -= quantity
-                    sell_holding = copy.deepcopy(holding)
-                    sell_holding.quantity = quantity
-                    sell_holding.sell(price, day)
-                # Case equal. Just sell
-                elif (holding.quantity == quantity):
-                    holding.sell(price, day)
-                    self.move_completed()
-                # Case too many. Only sell what we have.
-                elif (holding.quantity < quantity):
-                    holding.sell(price, day)
-                    self.move_completed()
-                self.cash += price
-
-                self.value_over_time[day] = self.total_value
-
-                break
+        return 100*(self.total_value - self.initial_cash) / self.initial_cash
+
+    def _record(self, row, quantity, buy_price, buy_tick, sell_price, sell_tick):
+        if (self.trade_count == len(self.trades)):
+            self.trades = np.concatenate([self.trades, np.zeros(len(self.trades), dtype=TRADE)])
+        self.trades[self.trade_count] = (row, quantity, buy_price, buy_tick, sell_price, sell_tick)
+        self.trade_count += 1
+
+    def sold(self, stock, price, tick, quantity):
+        """
+        Sell quantity of stock, oldest lots first.
+        Only what is held gets sold
+        """
+        if not self.holds(stock):
+            return
+        row = self.symbol_index[stock]
+        lots = self.lots[row]
+        quantity = min(quantity, self.quantity[row])
+        remaining = quantity
+        while (remaining > 0):
+            lot = lots[0]
+            amount = min(lot[0], remaining)
+            self._record(row, amount, lot[1], lot[2], price, tick)
+            self.realized += (price - lot[1]) * amount
+            self.cost_basis -= lot[1] * amount
+            self.cost[row] -= lot[1] * amount
+            lot[0] -= amount
+            if (lot[0] == 0):
+                lots.popleft()
+            remaining -= amount
+
+        self.cash += price * quantity
+        self.market_value -= self.mark_price[row] * quantity
+        self.quantity[row] -= quantity
+        if (self.quantity[row] == 0):
+            del self.held[row]
+            self.cost[row] = 0.0
+
+    @property
+    def records(self):
+        """ TRADE records of every lot sold so far
+        """
+        return self.trades[:self.trade_count]
+
+    @property
+    def historical(self):
+        return TradeLog(self)
+
+    @property
+    def active(self):
+        """ Holding for every lot still held
+        """
+        return [Holding(self.symbols[row], price, self.date(tick), quantity)
+                for row in self.held for quantity, price, tick in self.lots[row]]
+
+class TradeLog:
+    """
+    Sold lots of a portfolio as Holding objects, made when asked for
+    """
+
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
+
+    def __len__(self):
+        return self.portfolio.trade_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if (i < 0):
+            i += len(self)
+        assert 0 <= i < len(self), "Trade index out of range"
+        portfolio = self.portfolio
+        symbol, quantity, buy_price, buy_tick, sell_price, sell_tick = portfolio.trades[i].tolist()
+        holding = Holding(portfolio.symbols[symbol], buy_price, portfolio.date(buy_tick), quantity)
+        holding.sell(sell_price, portfolio.date(sell_tick))
+        return holding
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 class Holding:
 
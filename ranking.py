@@ -0,0 +1,33 @@
+"""
+Cross sectional ranking of scores kept in arrays, one entry per symbol.
+Uses partial selection (argpartition) so there is no full sort per tick.
+NaN scores and entries outside mask are never selected.
+"""
+import numpy as np
+
+def _candidates(scores, mask=None):
+    valid = ~np.isnan(scores)
+    if mask is not None:
+        valid &= mask
+    return np.flatnonzero(valid)
+
+def kth_largest(scores, k, mask=None):
+    """
+    Index of the k-th largest score (0 is the largest)
+    or None if there are not more than k candidates
+    """
+    candidates = _candidates(scores, mask)
+    if (len(candidates) <= k):
+        return None
+    position = np.argpartition(-scores[candidates], k)[k]
+    return candidates[position]
+
+def top_k(scores, k, mask=None):
+    """ Indexes of the k largest scores, largest first. Fewer if there are not enough candidates
+    """
+    candidates = _candidates(scores, mask)
+    if (k <= 0):
+        return candidates[:0]
+    if (len(candidates) > k):
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
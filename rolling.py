@@ -0,0 +1,109 @@
+import numpy as np
+
+class RollingWindow:
+    """
+    The latest capacity values of many symbols in one preallocated array.
+
+    Every value is written twice, at position and position + capacity,
+    in a (symbols x 2*capacity) buffer. The latest values of a symbol are
+    then always the contiguous slice ending at position + capacity, so
+    pushing is O(1) and reading a window never copies.
+
+    Symbols are added the first time they are pushed. Views handed out
+    are only valid until the next push.
+    """
+
+    def __init__(self, capacity, symbols=(), dtype=np.float64):
+        assert capacity > 0, "Window capacity must be positive"
+        self.capacity = capacity
+        self.symbols = []
+        self.index = {}
+        rows = max(len(symbols), 1)
+        self.buffer = np.full((rows, 2*capacity), np.nan, dtype=dtype)
+        self.position = np.zeros(rows, dtype=np.int64)
+        self.count = np.zeros(rows, dtype=np.int64)
+        for symbol in symbols:
+            self.add(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def add(self, symbol):
+        """ Register symbol and return its row. Storage doubles when full
+        """
+        row = len(self.symbols)
+        if (row == len(self.buffer)):
+            extra = len(self.buffer)
+            self.buffer = np.concatenate([self.buffer, np.full_like(self.buffer[:extra], np.nan)])
+            self.position = np.concatenate([self.position, np.zeros(extra, dtype=np.int64)])
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.symbols.append(symbol)
+        self.index[symbol] = row
+        return row
+
+    def row(self, symbol):
+        row = self.index.get(symbol)
+        if (row == None):
+            row = self.add(symbol)
+        return row
+
+    def push(self, symbol, value):
+        row = self.row(symbol)
+        p = self.position[row]
+        self.buffer[row, p] = value
+        self.buffer[row, p + self.capacity] = value
+        self.position[row] = (p + 1) % self.capacity
+        if (self.count[row] < self.capacity):
+            self.count[row] += 1
+
+    def push_rows(self, rows, values):
+        """
+        Push one value for each of rows at once. rows must not repeat.
+
+        Returns:
+            the values that fell out of the windows, NaN where a window was not full
+        """
+        p = self.position[rows]
+        evicted = np.where(self.count[rows] == self.capacity, self.buffer[rows, p], np.nan)
+        self.buffer[rows, p] = values
+        self.buffer[rows, p + self.capacity] = values
+        self.position[rows] = (p + 1) % self.capacity
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.capacity)
+        return evicted
+
+    def full(self, symbol):
+        row = self.index.get(symbol)
+        return (row != None) and (self.count[row] == self.capacity)
+
+    def window(self, symbol):
+        """ Contiguous view of the values of symbol, oldest first
+        """
+        row = self.row(symbol)
+        end = self.position[row] + self.capacity
+        return self.buffer[row, end - self.count[row]:end]
+
+    def windows(self, rows):
+        """
+        (len(rows) x capacity) matrix of full windows, oldest first.
+        A view when all rows share the same position, otherwise a copy
+        """
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return self.buffer[:0, :self.capacity]
+        positions = self.position[rows]
+        if np.all(positions == positions[0]) and np.all(np.diff(rows) == 1):
+            start = positions[0]
+            return self.buffer[rows[0]:rows[-1]+1, start:start + self.capacity]
+        columns = positions[:, None] + np.arange(self.capacity)
+        return self.buffer[rows[:, None], columns]
+
+    def lag(self, rows, k):
+        """ Value k steps before the newest for each of rows. 0 is the newest
+        """
+        return self.buffer[rows, self.position[rows] + self.capacity - 1 - k]
+
+    def clear(self):
+        """ Forget all values. Symbols stay registered
+        """
+        self.position[:] = 0
+        self.count[:] = 0
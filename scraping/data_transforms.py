@@ -1,7 +1,17 @@
 import glob
 import csv
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
 import pandas as pd
 
+# Market store lives in the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import store
+
 def dataframe2dict(filename):
     """
     change the dataframe into a very large dictionary of dictionaries
@@ -16,15 +26,11 @@ def dataframe2dict(filename):
     """
     df = pd.read_csv(filename)
     val_cols = ['open', 'close', 'high', 'low', 'volume']
-    times = pd.unique(df['timestamp'])
+    # One pass grouping instead of scanning the frame for every timestamp
     y = dict()
-    for time in times:
-        x = df.loc[df['timestamp']==time].to_dict()
-        inds = list(x['company'].keys())
-        tmp = dict()
-        for i in inds:
-            tmp[x['company'][i]] = {col: x[col][i] for col in val_cols}
-        y[time] = tmp
+    for timestamp, group in df.groupby('timestamp', sort=False):
+        values = group[val_cols].to_dict(orient="records")
+        y[timestamp] = dict(zip(group['company'], values))
     return y
 
 def load_csv(filename):
@@ -33,7 +39,7 @@ def load_csv(filename):
         data = list(filter(lambda x: x['Open'] != 'None', reader))
     return data
 
-def csv2dict(directory, filter_str="*.csv", big_dict={}):
+def csv2dict(directory, filter_str="*.csv", big_dict=None):
     """
     Data is scraped into csv on a per company basis.
     We want to organized the data with time as the keys
@@ -45,11 +51,15 @@ def csv2dict(directory, filter_str="*.csv", big_dict={}):
         filter_str: str
             string to filter out csv files that need to be added
         big_dict: dictionary
-            original dictionary to be updated
+            original dictionary to be updated. A new one if None
     Returns:
         big_dict: dictionary with new time values updated
 
+    For a market store use append instead, it does not need
+    the whole history in memory.
     """
+    if big_dict is None:
+        big_dict = {}
     # Get all filter to parse
     intra_files = glob.glob(f"{directory}/"+filter_str)
     # Tmp dictionary to hold all the data loaded
@@ -65,7 +75,7 @@ def csv2dict(directory, filter_str="*.csv", big_dict={}):
             # Use both the date and time are separate keys
             date_time = item['Time']
             date = date_time.split(" ")[0].strip()
-            time = date_time.split(" ")[1].strip()
+            clock = date_time.split(" ")[1].strip()
 
             company_dict = { stock: {
                                 "open":   item['Open'],
@@ -77,26 +87,175 @@ def csv2dict(directory, filter_str="*.csv", big_dict={}):
                            }
             # Handle cases where this is first instance of date time keys
             if tmp_dict.get(date):
-                if tmp_dict[date].get(time):
-                    tmp_dict[date][time].update(company_dict)
+                if tmp_dict[date].get(clock):
+                    tmp_dict[date][clock].update(company_dict)
                 else:
-                    tmp_dict[date].update({time: {}})
-                    tmp_dict[date][time].update(company_dict)
+                    tmp_dict[date].update({clock: {}})
+                    tmp_dict[date][clock].update(company_dict)
             else:
                 tmp_dict[date] = {}
-                if tmp_dict[date].get(time):
-                    tmp_dict[date][time].update(company_dict)
+                if tmp_dict[date].get(clock):
+                    tmp_dict[date][clock].update(company_dict)
                 else:
-                    tmp_dict[date].update({time: {}})
-                    tmp_dict[date][time].update(company_dict)
+                    tmp_dict[date].update({clock: {}})
+                    tmp_dict[date][clock].update(company_dict)
 
     # Only update new keys into larger dictionary
     for k in tmp_dict.keys():
-        if k not in big_dict.keys()
+        if k not in big_dict.keys():
             big_dict[k] = tmp_dict[k]
 
     return big_dict
 
+# Column names used by the different scrapers for the time stamp
+TIME_COLUMNS = ("time", "timestamp", "date")
+
+def parse_times(column, filename=""):
+    """
+    Time stamps of a csv column. marketwatch_scrape writes raw epoch
+    milliseconds, anything numeric is taken to be those. pd.to_datetime
+    would read them as nanoseconds, putting every row in 1970
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        assert (len(column) == 0) or (column.min() > 1e11), \
+                f"Numeric times in {filename} are not epoch milliseconds"
+        return pd.to_datetime(column, unit="ms")
+    return pd.to_datetime(column)
+
+def read_price_csv(filename):
+    """
+    Vectorized read of one scraped csv. Handles both the marketwatch
+    intraday files (Time,Open,Close,High,Low,Volume with Time in epoch
+    milliseconds) and the daily files
+    (timestamp,open,high,low,close,volume). Rows without an open are dropped.
+
+    Returns:
+        stock, times (int64 seconds since epoch) and values (rows x store.FIELDS)
+    """
+    stock = os.path.basename(filename).split("_")[0]
+    df = pd.read_csv(filename, na_values=["None"])
+    df.columns = [c.strip().lower() for c in df.columns]
+    time_col = [c for c in TIME_COLUMNS if c in df.columns][0]
+    df = df[df["open"].notna()]
+    times = store.to_epoch(parse_times(df[time_col], filename).values)
+    values = df[list(store.FIELDS)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    return stock, times, values
+
+def read_price_files(files, processes=None):
+    """ Read csv files across a process pool, results in the order of files
+    """
+    with Pool(processes) as pool:
+        return list(pool.imap(read_price_csv, files, chunksize=8))
+
+def arrays_to_blocks(results, partition="month"):
+    """
+    Scatter per company (stock, times, values) results into dense
+    (time x symbol x field) blocks, one per store partition.
+    Files can overlap in time. Later results win.
+
+    Yields:
+        key, times, symbols, block
+    """
+    symbols = sorted({stock for stock, _, _ in results})
+    column = {stock: i for i, stock in enumerate(symbols)}
+
+    # Sort the rows of each file by time once and note which of them fall
+    # in each partition. Rows are only gathered a partition at a time, so
+    # no more than one partition is copied at once
+    orders = []
+    pieces = {}
+    for i, (stock, times, values) in enumerate(results):
+        order = np.argsort(times, kind="stable")
+        orders.append(order)
+        if (len(times) > 0):
+            for key, start, end in store.partition_bounds(times[order], partition):
+                pieces.setdefault(key, []).append((i, start, end))
+
+    for key in sorted(pieces):
+        picks = [orders[i][start:end] for i, start, end in pieces[key]]
+        files = [results[i] for i, _, _ in pieces[key]]
+        times = np.concatenate([file_times[p] for (_, file_times, _), p in zip(files, picks)])
+        values = np.concatenate([file_values[p] for (_, _, file_values), p in zip(files, picks)])
+        columns = np.concatenate([np.full(len(p), column[stock], dtype=np.int64)
+                                  for (stock, _, _), p in zip(files, picks)])
+        part_times, rows = np.unique(times, return_inverse=True)
+
+        # Keep the last of repeated (time, symbol) cells, files are in order.
+        # unique on the reversed cells finds the last occurrence of each
+        cells = rows * len(symbols) + columns
+        _, last = np.unique(cells[::-1], return_index=True)
+        last = len(cells) - 1 - last
+        block = np.full((len(part_times), len(symbols), len(store.FIELDS)), np.nan)
+        block[rows[last], columns[last]] = values[last]
+        yield key, part_times, symbols, block
+
+def ingest(directory, root, filter_str="*.csv", processes=None, partition="day", intraday=True):
+    """
+    Bulk load scraped csv files straight into a new market store.
+
+    Args:
+        directory: str
+            location of csv files to be processed
+        root: str
+            store directory to write
+        filter_str: str
+            e.g. "*_intra_1min_*.csv" or "*_daily.csv"
+        processes: int
+            size of the process pool. Defaults to all cores
+        partition: str
+            "day", "month" or "year" partitions in the store
+        intraday: bool
+            False for daily data so dates are kept without time
+    Returns:
+        store meta data
+    """
+    files = sorted(glob.glob(os.path.join(directory, filter_str)))
+    assert len(files) > 0, f"No files matching {filter_str} in {directory}"
+    start = time.perf_counter()
+
+    results = read_price_files(files, processes)
+    rows = sum(len(times) for _, times, _ in results)
+    read_time = time.perf_counter() - start
+    print(f"Read {rows} rows from {len(files)} files in {read_time:.1f}s ({rows / read_time:.0f} rows/sec)")
+
+    os.makedirs(root, exist_ok=True)
+    partitions = []
+    symbols = []
+    for key, times, symbols, block in arrays_to_blocks(results, partition):
+        partitions.append(store.write_block(root, key, times, symbols, block))
+    meta = store.write_meta(root, symbols, partitions, partition=partition, intraday=intraday)
+
+    total_time = time.perf_counter() - start
+    print(f"Wrote {len(partitions)} partitions to {root} in {total_time:.1f}s ({rows / total_time:.0f} rows/sec)")
+    return meta
+
+def append(directory, root, filter_str="*_intra_1min_*.csv", processes=None):
+    """
+    Add newly scraped csv files to an existing market store.
+    Overlapping windows from earlier scrapes are matched on
+    (timestamp, company) and only partitions with new data are rewritten.
+    """
+    files = sorted(glob.glob(os.path.join(directory, filter_str)))
+    assert len(files) > 0, f"No files matching {filter_str} in {directory}"
+    start = time.perf_counter()
+
+    results = read_price_files(files, processes)
+    rows = sum(len(times) for _, times, _ in results)
+    partition = store.read_meta(root)["partition"]
+    meta = store.append_blocks(root, arrays_to_blocks(results, partition))
+
+    total_time = time.perf_counter() - start
+    print(f"Appended {rows} rows from {len(files)} files in {total_time:.1f}s ({rows / total_time:.0f} rows/sec)")
+    return meta
+
 
 if __name__ == "__main__":
-    pass
+    # python data_transforms.py <csv directory> <store directory> [filter]
+    # Appends to the store if it already exists
+    directory, root = sys.argv[1], sys.argv[2]
+    filter_str = sys.argv[3] if len(sys.argv) > 3 else "*_intra_1min_*.csv"
+    if os.path.exists(os.path.join(root, "meta.json")):
+        append(directory, root, filter_str=filter_str)
+    else:
+        intraday = "intra" in filter_str
+        ingest(directory, root, filter_str=filter_str, partition="day" if intraday else "year", intraday=intraday)
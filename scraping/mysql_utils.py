@@ -1,16 +1,91 @@
-import mysql.connector
 import os
+import sys
 import csv
 import glob
+import time
+from multiprocessing import Pool
+
+# Connection pools live in the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from database import mysql_pool
+
+def filename_to_ticker(filename):
+    return os.path.basename(filename).split("_")[0]
+
+def read_rows(filename):
+    """
+    Rows of a scraped csv ready for the insert statement.
+    Rows without an open price are skipped. Missing volume is 0
+    """
+    ticker = filename_to_ticker(filename)
+    rows = []
+    with open(filename, "r") as fh:
+        for datum in csv.DictReader(fh):
+            if (datum['Open'] == "None"):
+                continue
+            if (datum['Volume'] == "None"):
+                datum['Volume'] = 0
+            rows.append((ticker, datum['Time'], datum['Open'], datum['High'],
+                         datum['Low'], datum['Close'], datum['Volume']))
+    return rows
+
+def load_file(filename, table_name, pool, batch_size=1000, commit_every=50000):
+    """
+    Insert one file with executemany in batches of batch_size rows,
+    committing every commit_every rows and at the end.
+    pool is a database.ConnectionPool, left open for the next file
+
+    Returns:
+        ticker, number of rows, seconds taken
+    """
+    start = time.perf_counter()
+    rows = read_rows(filename)
+    insert = pool.sql(f"REPLACE INTO {table_name} (company, date, open, high, low, close, volume) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    with pool.connection() as con:
+        cur = con.cursor()
+        uncommitted = 0
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i+batch_size]
+            cur.executemany(insert, batch)
+            uncommitted += len(batch)
+            if (uncommitted >= commit_every):
+                con.commit()
+                uncommitted = 0
+        con.commit()
+        cur.close()
+    return filename_to_ticker(filename), len(rows), time.perf_counter() - start
+
+# Connection pool of a worker process, opened once by _init_worker
+_pool = None
+
+def _init_worker(pool_factory):
+    global _pool
+    _pool = pool_factory()
+
+def _load_file(args):
+    filename, table_name, batch_size, commit_every = args
+    return load_file(filename, table_name, _pool, batch_size, commit_every)
 
 class DatabaseAdder:
+    """
+    Bulk loads a directory of scraped csv files into a table.
+    Files are spread over a pool of processes, each opening its own
+    connection once and using it for every file it loads.
+
+    pool_factory makes a database.ConnectionPool in each worker.
+    It has to be picklable, e.g. a module level function or
+    functools.partial(database.sqlite_pool, "stocks.db")
+    """
 
-    def __init__(self, file_dir, table_name):
-        self.con = mysql.connector.connect(user="klinton", database="stocks", password="43MY39ka!")
-        self.cur = self.con.cursor()
+    def __init__(self, file_dir, table_name, pool_factory=mysql_pool, batch_size=1000,
+                 commit_every=50000, processes=None):
         self.files = glob.glob(os.path.join(file_dir,"*"))
-        self.insert_new = (f"REPLACE INTO {table_name} (company, date, open, high, low, close, volume)"
-                           "VALUES (%s, %s, %s, %s, %s, %s, %s)")
+        self.table_name = table_name
+        self.pool_factory = pool_factory
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.processes = processes
 
     def read_file(self, daily_file):
         with open(daily_file, "r") as fh:
@@ -18,22 +93,30 @@ class DatabaseAdder:
         return data
 
     def filename_to_ticker(self, filename):
-        ticker = filename.split("/")[2].split("_")[0]
-        return ticker
+        return filename_to_ticker(filename)
 
     def add_all_to_database(self):
-        for day_file in self.files:
-            ticker = self.filename_to_ticker(day_file)
-            data = self.read_file(day_file)
-            print(f"Adding {ticker} to database")
-            print(f"Adding {len(data)} rows")
-            for datum in data:
-                if (datum['Open'] == "None"):
-                    continue
-                if (datum['Volume'] == "None"):
-                    datum['Volume'] = 0
-                self.cur.execute(self.insert_new, (ticker, datum['Time'], datum['Open'],
-                                                   datum['High'], datum['Low'], datum['Close'],
-                                                   datum['Volume']))
-            print(f"Finished {ticker}")
-        print("Still need to commit changes")
+        start = time.perf_counter()
+        jobs = [(f, self.table_name, self.batch_size, self.commit_every) for f in self.files]
+        if (self.processes == 1):
+            pool = self.pool_factory()
+            try:
+                total = self._report(load_file(f, table, pool, batch, every) for f, table, batch, every in jobs)
+            finally:
+                pool.close()
+        else:
+            with Pool(self.processes, initializer=_init_worker, initargs=(self.pool_factory,)) as workers:
+                total = self._report(workers.imap_unordered(_load_file, jobs))
+
+        seconds = time.perf_counter() - start
+        print(f"Finished {total} rows from {len(self.files)} files in {seconds:.1f}s ({total / max(seconds, 1e-9):.0f} rows/sec)")
+        return total
+
+    def _report(self, results):
+        """ Print each file as it finishes, returns the total rows
+        """
+        total = 0
+        for ticker, rows, seconds in results:
+            total += rows
+            print(f"Added {rows} rows of {ticker} in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/sec)")
+        return total
@@ -0,0 +1,414 @@
+"""
+On disk market format. A directory with
+
+    meta.json                 header: version, fields, symbols and partitions
+    <partition>/times.npy     int64 seconds since epoch, sorted
+    <partition>/prices.npy    (symbol x time x field) prices, NaN if missing
+    <partition>/symbols.json  companies in the order of the prices rows
+
+Data is split into time partitions (a day, month or year each).
+Arrays are opened memory mapped so only the symbols and
+time range that get used are read from disk. New data is appended by
+rewriting only the partitions it falls in (see append_blocks).
+"""
+import json
+import os
+import pickle
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+
+# Field layout of the last axis of the price arrays
+FIELDS = ("open", "close", "high", "low", "volume")
+OPEN, CLOSE, HIGH, LOW, VOLUME = range(len(FIELDS))
+
+# numpy datetime units for each partition size
+PARTITION_UNITS = {"day": "D", "month": "M", "year": "Y"}
+
+def _to_float(value):
+    """ Scraped values can be numbers, strings or missing
+    """
+    if (value is None) or (value == "None") or (value == ""):
+        return np.nan
+    return float(value)
+
+def dict_to_arrays(data, dtype=np.float64):
+    """
+    Turn the dictionary used by StockMarketDict
+    { timestamps: { companies: { open: close: ... } } }
+    into dense arrays. Missing values are NaN.
+
+    Returns:
+        dates: sorted list of timestamps
+        symbols: sorted list of companies
+        prices: array (time x symbol x field) with fields in FIELDS order
+    """
+    dates = sorted(data.keys())
+    symbols = sorted({stock for tick in data.values() for stock in tick})
+    symbol_index = {stock: i for i, stock in enumerate(symbols)}
+    prices = np.full((len(dates), len(symbols), len(FIELDS)), np.nan, dtype=dtype)
+    for t, day in enumerate(dates):
+        row = prices[t]
+        for stock, values in data[day].items():
+            if (values == None):
+                continue
+            row[symbol_index[stock]] = [_to_float(values.get(field)) for field in FIELDS]
+    return dates, symbols, prices
+
+def frame_to_arrays(df, time_col="timestamp", company_col="company", dtype=np.float64):
+    """
+    Same as dict_to_arrays for a long format DataFrame with
+    one row per (timestamp, company) like daily_all.csv
+    Later rows win if a (timestamp, company) pair repeats.
+    """
+    times = pd.to_datetime(df[time_col])
+    time_codes, dates = pd.factorize(times, sort=True)
+    symbol_codes, symbols = pd.factorize(df[company_col], sort=True)
+    values = df[list(FIELDS)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=dtype)
+    prices = np.full((len(dates), len(symbols), len(FIELDS)), np.nan, dtype=dtype)
+    prices[time_codes, symbol_codes] = values
+    return to_epoch(dates.values), list(symbols), prices
+
+def to_epoch(dates):
+    """ Timestamp strings or datetime64 values to int64 seconds since epoch
+    """
+    return np.asarray(dates, dtype="datetime64[s]").astype(np.int64)
+
+def time_axis(dates):
+    """
+    Timestamp strings or datetime64 values to int64 seconds since epoch,
+    the session (days since epoch) and the seconds into the day of each
+    """
+    times = to_epoch(dates)
+    return times, times // 86400, times % 86400
+
+def format_dates(times, intraday=True):
+    """ int64 seconds since epoch back to the timestamp strings used as keys
+    """
+    if (intraday):
+        strings = np.datetime_as_string(times.astype("datetime64[s]"))
+        return [s.replace("T", " ") for s in strings.tolist()]
+    return np.datetime_as_string(times.astype("datetime64[s]").astype("datetime64[D]")).tolist()
+
+def _atomic_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump(obj, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+def read_meta(root):
+    with open(os.path.join(root, "meta.json"), "r") as fh:
+        meta = json.load(fh)
+    assert meta.get("version") == STORE_VERSION, \
+            f"Store {root} has version {meta.get('version')}, can only read {STORE_VERSION}"
+    return meta
+
+def write_partition(root, name, times, symbols, prices):
+    """
+    Write one partition into its own directory. Written under a temporary
+    name and renamed so a partially written partition is never visible.
+        times: int64 (time,)
+        prices: (time x symbol x field)
+    """
+    final = os.path.join(root, name)
+    tmp = final + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "times.npy"), np.ascontiguousarray(times, dtype=np.int64))
+    np.save(os.path.join(tmp, "prices.npy"), np.ascontiguousarray(prices.transpose(1, 0, 2)))
+    with open(os.path.join(tmp, "symbols.json"), "w") as fh:
+        json.dump(list(symbols), fh)
+    if os.path.exists(final):
+        shutil.rmtree(final)
+    os.replace(tmp, final)
+    return {"path": name, "start": int(times[0]), "end": int(times[-1]), "rows": len(times)}
+
+def partition_keys(times, partition="month"):
+    """ Partition name of every timestamp, e.g. 2020-08 for month
+    """
+    unit = PARTITION_UNITS[partition]
+    return np.datetime_as_string(times.astype("datetime64[s]").astype(f"datetime64[{unit}]"))
+
+def write_store(root, times, symbols, prices, partition="month", intraday=True):
+    """
+    Write a new store from dense arrays
+        times: int64 seconds since epoch or timestamp strings, sorted
+        symbols: list of companies
+        prices: (time x symbol x field)
+    """
+    times = np.asarray(times)
+    if (times.dtype.kind != "i"):
+        times = to_epoch(times)
+    assert np.all(np.diff(times) > 0), "Timestamps must be sorted and unique"
+    os.makedirs(root, exist_ok=True)
+
+    partitions = []
+    for key, start, end in partition_bounds(times, partition):
+        info = write_block(root, key, times[start:end], symbols, prices[start:end])
+        partitions.append(info)
+
+    return write_meta(root, symbols, partitions, partition=partition, intraday=intraday, dtype=prices.dtype)
+
+def partition_bounds(times, partition="month"):
+    """ (key, start, end) row ranges of each partition in sorted times
+    """
+    keys = partition_keys(times, partition)
+    # Keys are sorted since times are. Split where they change
+    bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate([[0], bounds]).astype(int)
+    ends = np.concatenate([bounds, [len(times)]]).astype(int)
+    return [(str(keys[start]), start, end) for start, end in zip(starts, ends)]
+
+def write_block(root, key, times, symbols, block, generation=0):
+    """
+    Write the (time x symbol x field) block of one partition.
+    Only companies with some data in the block are kept
+    """
+    columns = np.flatnonzero(~np.isnan(block).all(axis=(0, 2)))
+    info = write_partition(root, f"{key}.{generation}", times,
+                           [symbols[c] for c in columns], block[:, columns])
+    info["key"] = key
+    return info
+
+def write_meta(root, symbols, partitions, partition="month", intraday=True, dtype=np.float64):
+    """
+    Header is written last and swapped in atomically. Readers only
+    ever see partitions that are fully written
+    """
+    meta = {"version": STORE_VERSION,
+            "fields": list(FIELDS),
+            "dtype": np.dtype(dtype).str,
+            "intraday": intraday,
+            "partition": partition,
+            "symbols": list(symbols),
+            "partitions": partitions}
+    _atomic_json(os.path.join(root, "meta.json"), meta)
+    return meta
+
+def open_store(root, stocks=[], start=None, end=None):
+    """
+    Read a store written by write_store. Only the partitions overlapping
+    [start, end] and the rows for stocks are paged in from disk.
+
+    Args:
+        stocks: list of companies. Empty for all of them
+        start, end: timestamp strings or None for no limit. Inclusive
+    Returns:
+        dates, symbols, prices same as dict_to_arrays
+    """
+    meta = read_meta(root)
+    assert tuple(meta["fields"]) == FIELDS, f"Store fields {meta['fields']} do not match {FIELDS}"
+    symbols = list(stocks) if stocks else meta["symbols"]
+    column = {stock: i for i, stock in enumerate(symbols)}
+    lo = -np.inf if start is None else int(to_epoch([start])[0])
+    hi = np.inf if end is None else int(to_epoch([end])[0])
+
+    # Find the rows needed from every partition before reading prices
+    pieces = []
+    for info in meta["partitions"]:
+        if (info["end"] < lo) or (info["start"] > hi):
+            continue
+        path = os.path.join(root, info["path"])
+        times = np.load(os.path.join(path, "times.npy"), mmap_mode="r")
+        first = np.searchsorted(times, lo, side="left")
+        last = np.searchsorted(times, hi, side="right")
+        if last > first:
+            pieces.append((path, first, last, np.array(times[first:last])))
+
+    times = np.concatenate([p[3] for p in pieces]) if pieces else np.array([], dtype=np.int64)
+    prices = np.full((len(times), len(symbols), len(FIELDS)), np.nan, dtype=np.dtype(meta["dtype"]))
+    row = 0
+    for path, first, last, _ in pieces:
+        with open(os.path.join(path, "symbols.json"), "r") as fh:
+            part_symbols = json.load(fh)
+        part_prices = np.load(os.path.join(path, "prices.npy"), mmap_mode="r")
+        rows = last - first
+        for p, stock in enumerate(part_symbols):
+            c = column.get(stock)
+            if (c != None):
+                prices[row:row+rows, c] = part_prices[p, first:last]
+        row += rows
+
+    return format_dates(times, meta["intraday"]), symbols, prices
+
+class StoreLock:
+    """
+    Only one writer at a time. Readers do not need the lock since
+    they only follow meta.json which is swapped in atomically
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, ".lock")
+
+    def __enter__(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise AssertionError(f"Store is locked by another writer. Remove {self.path} if that writer died")
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return self
+
+    def __exit__(self, *args):
+        os.remove(self.path)
+
+def _next_generation(root, key, info):
+    """ New directory name for a rewritten partition so the old one stays readable
+    """
+    generation = int(info["path"].rsplit(".", 1)[1]) + 1 if info else 0
+    while os.path.exists(os.path.join(root, f"{key}.{generation}")):
+        generation += 1
+    return generation
+
+def merge_block(root, info, times, symbols, block):
+    """
+    Merge new (time x symbol x field) data into an existing partition.
+    Cells are matched on the (timestamp, company) index. New values win.
+
+    Returns:
+        new partition info or None if nothing changed
+    """
+    path = os.path.join(root, info["path"])
+    old_times = np.load(os.path.join(path, "times.npy"))
+    with open(os.path.join(path, "symbols.json"), "r") as fh:
+        old_symbols = json.load(fh)
+    old_prices = np.load(os.path.join(path, "prices.npy"), mmap_mode="r")
+
+    # Only companies that have data in the new block
+    new_columns = np.flatnonzero(~np.isnan(block).all(axis=(0, 2)))
+    merged_symbols = list(old_symbols)
+    column = {stock: i for i, stock in enumerate(merged_symbols)}
+    for c in new_columns:
+        if symbols[c] not in column:
+            column[symbols[c]] = len(merged_symbols)
+            merged_symbols.append(symbols[c])
+
+    merged_times = np.union1d(old_times, times)
+    merged = np.full((len(merged_times), len(merged_symbols), len(FIELDS)), np.nan, dtype=old_prices.dtype)
+    old_rows = np.searchsorted(merged_times, old_times)
+    merged[old_rows, :len(old_symbols)] = old_prices.transpose(1, 0, 2)
+
+    rows = np.searchsorted(merged_times, times)
+    columns = np.array([column[symbols[c]] for c in new_columns], dtype=int)
+    new_values = block[:, new_columns]
+    old_values = merged[rows[:, None], columns[None, :]]
+    have = ~np.isnan(new_values).all(axis=2)
+    same = ((old_values == new_values) | (np.isnan(old_values) & np.isnan(new_values))).all(axis=2)
+    changed = have & ~same
+    if (not changed.any()) and (len(merged_times) == len(old_times)):
+        return None
+
+    r, c = np.nonzero(changed)
+    merged[rows[r], columns[c]] = new_values[r, c]
+    key = info["key"]
+    generation = _next_generation(root, key, info)
+    new_info = write_partition(root, f"{key}.{generation}", merged_times, merged_symbols, merged)
+    new_info["key"] = key
+    return new_info
+
+def append_blocks(root, blocks):
+    """
+    Add new data to an existing store. Work is proportional to
+    the new data and the partitions it lands in, nothing else is read or
+    rewritten. Touched partitions are written under a new generation
+    and meta.json is swapped last, so open readers stay consistent.
+    Old generations are left for vacuum to remove.
+
+    Args:
+        blocks: iterable of (key, times, symbols, block) as made
+                by partition_bounds over the store's partition size
+    Returns:
+        store meta data
+    """
+    with StoreLock(root):
+        meta = read_meta(root)
+        existing = {info["key"]: info for info in meta["partitions"]}
+        all_symbols = list(meta["symbols"])
+        known = set(all_symbols)
+        changed = 0
+
+        for key, times, symbols, block in blocks:
+            info = existing.get(key)
+            if (info == None):
+                new_info = write_block(root, key, times, symbols, block, generation=_next_generation(root, key, None))
+            else:
+                new_info = merge_block(root, info, times, symbols, block)
+            if (new_info == None):
+                continue
+
+            changed += 1
+            existing[key] = new_info
+            with open(os.path.join(root, new_info["path"], "symbols.json"), "r") as fh:
+                for stock in json.load(fh):
+                    if stock not in known:
+                        known.add(stock)
+                        all_symbols.append(stock)
+
+        if (changed == 0):
+            return meta
+        partitions = sorted(existing.values(), key=lambda info: info["start"])
+        return write_meta(root, all_symbols, partitions, partition=meta["partition"],
+                          intraday=meta["intraday"], dtype=meta["dtype"])
+
+def append_store(root, times, symbols, prices):
+    """ append_blocks from dense arrays like the ones write_store takes
+    """
+    times = np.asarray(times)
+    if (times.dtype.kind != "i"):
+        times = to_epoch(times)
+    order = np.argsort(times, kind="stable")
+    times, prices = times[order], prices[order]
+    assert np.all(np.diff(times) > 0), "Timestamps must be unique"
+    partition = read_meta(root)["partition"]
+    blocks = ((key, times[start:end], symbols, prices[start:end])
+              for key, start, end in partition_bounds(times, partition))
+    return append_blocks(root, blocks)
+
+def vacuum(root):
+    """
+    Remove partition generations meta.json no longer points to.
+    Only run when no reader opened the store before the last append
+    """
+    with StoreLock(root):
+        meta = read_meta(root)
+        live = {info["path"] for info in meta["partitions"]}
+        removed = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.isdir(path) and (name not in live):
+                shutil.rmtree(path)
+                removed.append(name)
+        return removed
+
+def convert_pickle(pickle_file, root, partition="day"):
+    """ Convert a StockMarketDict pickle into a store
+    """
+    with open(pickle_file, "rb") as fh:
+        data = pickle.load(fh)
+    dates, symbols, prices = dict_to_arrays(data)
+    del data
+    intraday = len(dates[0].split(" ")) == 2 if dates else True
+    return write_store(root, to_epoch(dates), symbols, prices, partition=partition, intraday=intraday)
+
+def convert_csv(csv_file, root, partition="year", intraday=False):
+    """ Convert a long format csv like daily_all.csv into a store
+    """
+    df = pd.read_csv(csv_file)
+    times, symbols, prices = frame_to_arrays(df)
+    return write_store(root, times, symbols, prices, partition=partition, intraday=intraday)
+
+if __name__ == "__main__":
+    # python store.py <source .pkl or .csv> <store directory>
+    source, root = sys.argv[1], sys.argv[2]
+    if source.endswith(".csv"):
+        meta = convert_csv(source, root)
+    else:
+        meta = convert_pickle(source, root)
+    print(f"Wrote {len(meta['symbols'])} symbols in {len(meta['partitions'])} partitions to {root}")
@@ -0,0 +1,161 @@
+"""
+Parameter sweeps of the agents over a process pool. The market's price
+array is put in shared memory once and every worker attaches to it
+instead of loading or unpickling its own copy. Results are printed (and
+optionally appended to a csv file) as runs finish.
+
+    grid = param_grid(mac1_num=[20, 26, 32], mac2_num=[8, 12], macd_num=[9])
+    summary = run_sweep(market, AgentMACD, grid, stocks=["AMZN"])
+
+Agents with compute_signals (all but AgentWaveTrend) run on the vectorized
+backtest engine, the rest are stepped through the Executor.
+"""
+import itertools
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtest import run_backtest
+from main import Executor
+from market import StockMarketArray
+from portfolio import Portfolio
+
+def param_grid(**params):
+    """ Every combination of the given parameter lists as a list of dicts
+    """
+    names = list(params.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*params.values())]
+
+class SharedMarket:
+    """
+    Prices of a StockMarketArray copied once into shared memory.
+    Pickling it only sends the name of the memory block, the dates, their
+    parsed int64 times, the symbols and the market's settings, so it can be
+    handed to pool workers which attach() to the block without parsing the
+    dates again. The process that made it has to close() it, or use it in
+    a with block.
+    """
+
+    def __init__(self, market):
+        self.dates = market.dates
+        self.times = market.times
+        self.symbols = market.symbols
+        self.stocks = market.stocks
+        self.random_price = market.random_price
+        self.shape = market.prices.shape
+        self.dtype = market.prices.dtype
+        self.memory = shared_memory.SharedMemory(create=True, size=max(market.prices.nbytes, 1))
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)[:] = market.prices
+        self.name = self.memory.name
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["memory"] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self, start=0, end=None):
+        """
+        StockMarketArray over the shared prices, ticks start to end.
+        Nothing is copied
+        """
+        memory = shared_memory.SharedMemory(name=self.name)
+        prices = np.ndarray(self.shape, dtype=self.dtype, buffer=memory.buf)
+        market = StockMarketArray.from_arrays(self.dates, self.symbols, prices, self.stocks, self.random_price,
+                                              self.times).slice(start, end)
+        # The memory block has to outlive the market using it
+        market.shared_memory = memory
+        return market
+
+    def close(self):
+        if (self.memory != None):
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+def backtest_agent(market, agent_class, params, stocks=None, cash=10000, close_time="18:30:00"):
+    """
+    Backtest agent_class(stocks, **params) on market
+
+    Returns:
+        dict of the params, final gain, trades and the metrics.summary numbers
+    """
+    if (stocks == None):
+        stocks = market.symbols
+    start = time.perf_counter()
+    agent = agent_class(stocks=stocks, **params)
+    if hasattr(agent, "compute_signals"):
+        result = run_backtest(agent.compute_signals(market), market, cash=cash, close_time=close_time)
+        # Final gain after every fill. Tracking stops for the day once the agent acts
+        gain = float(result.gain[-1]) if (len(result.gain) > 0) else 0.0
+        trades = int(np.count_nonzero(result.trades["sell_tick"] >= 0))
+        metrics = result.metrics()
+    else:
+        executor = Executor(agent, market, Portfolio(cash=cash), stocks, time=True, close_time=close_time)
+        executor.run()
+        gain = executor.portfolio.total_gain
+        trades = executor.portfolio.trade_count
+        metrics = executor.metrics.summary()
+    summary = dict(params)
+    summary.update({"gain": gain})
+    summary.update(metrics)
+    summary.update({"trades": trades, "seconds": time.perf_counter() - start})
+    return summary
+
+# Market of a pool worker, attached once by _init_worker
+_market = None
+
+def _init_worker(shared):
+    global _market
+    _market = shared.attach()
+
+def _backtest(args):
+    return backtest_agent(_market, *args)
+
+def run_sweep(market, agent_class, grid, stocks=None, cash=10000, close_time="18:30:00",
+              processes=None, out_file=None):
+    """
+    Backtest agent_class with every params dict of grid over a pool of
+    processes sharing the market's prices.
+        out_file: csv file rows are appended to as runs finish
+
+    Returns:
+        DataFrame with a row per run, best gain first
+    """
+    if not isinstance(market, StockMarketArray):
+        market = StockMarketArray.from_dict(market.data)
+    jobs = [(agent_class, params, stocks, cash, close_time) for params in grid]
+    rows = []
+    start = time.perf_counter()
+    if (processes == 1):
+        results = (backtest_agent(market, *job) for job in jobs)
+        shared = None
+    else:
+        shared = SharedMarket(market)
+        workers = Pool(processes, initializer=_init_worker, initargs=(shared,))
+        results = workers.imap_unordered(_backtest, jobs)
+
+    try:
+        for row in results:
+            rows.append(row)
+            print(", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in row.items()))
+            if (out_file != None):
+                pd.DataFrame([row]).to_csv(out_file, mode="a", index=False, header=not os.path.exists(out_file))
+    finally:
+        if (shared != None):
+            workers.close()
+            workers.join()
+            shared.close()
+    print(f"Finished {len(rows)} {agent_class.__name__} runs in {time.perf_counter() - start:.1f}s")
+    summary = pd.DataFrame(rows)
+    if (len(summary) > 0):
+        summary = summary.sort_values("gain", ascending=False, ignore_index=True)
+    return summary
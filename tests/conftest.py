@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market import StockMarketArray
+from store import FIELDS
+
+# Mon 2020-08-03 onwards. Wednesday the 5th is left out and the weekend
+# is skipped, so there are gaps between sessions
+SESSIONS = ["2020-08-03", "2020-08-04", "2020-08-06", "2020-08-07", "2020-08-10", "2020-08-11"]
+
+def make_market(symbols=("AMZN", "FB", "GOOG", "T"), minutes=60, start="13:30", missing=0.03, seed=0):
+    """
+    Small synthetic 1 minute StockMarketArray, random walk prices
+    with some missing values
+    """
+    rng = np.random.default_rng(seed)
+    days = np.array(SESSIONS, dtype="datetime64[D]").astype("datetime64[s]")
+    first = np.timedelta64(int(start[:2]) * 3600 + int(start[3:]) * 60, "s")
+    times = (days[:, None] + first + np.arange(minutes) * np.timedelta64(60, "s")).ravel()
+    dates = [str(t).replace("T", " ") for t in times]
+
+    walk = np.cumprod(1 + 0.003 * rng.standard_normal((len(dates), len(symbols))), axis=0)
+    opens = (100 + 10 * np.arange(len(symbols))) * walk
+    prices = np.empty((len(dates), len(symbols), len(FIELDS)))
+    prices[:, :, FIELDS.index("open")] = opens
+    prices[:, :, FIELDS.index("close")] = opens * (1 + 0.001 * rng.standard_normal(opens.shape))
+    prices[:, :, FIELDS.index("high")] = opens * 1.002
+    prices[:, :, FIELDS.index("low")] = opens * 0.998
+    prices[:, :, FIELDS.index("volume")] = rng.integers(0, 1000, opens.shape)
+    prices[rng.random(opens.shape) < missing] = np.nan
+    return StockMarketArray.from_arrays(dates, list(symbols), prices)
+
+@pytest.fixture
+def market():
+    return make_market()
@@ -0,0 +1,58 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from agent import AgentMACD, AgentMeanReversion, AgentRandom
+from backtest import run_backtest
+from main import Executor
+from market import StockMarketDict
+from parity import check_backtest_parity
+from portfolio import Portfolio
+
+AGENTS = {
+    "macd": lambda stocks: AgentMACD(stocks=stocks),
+    "mean_reversion": lambda stocks: AgentMeanReversion(stocks=stocks),
+    "random": lambda stocks: AgentRandom(stocks=stocks, seed=3),
+}
+
+# On a tick, on the first tick of each session and between ticks
+CLOSE_TIMES = ["14:15:00", "13:30:00", "14:15:30"]
+
+def test_fixture(market):
+    sessions = np.unique(market.session_date)
+    assert np.diff(sessions).max() > 1, "Fixture needs a gap between sessions"
+    result = run_backtest(AgentMACD(stocks=market.symbols).compute_signals(market), market, close_time="14:15:00")
+    assert len(result.trades) > 0, "Fixture needs to trade"
+
+@pytest.mark.parametrize("agent", AGENTS)
+@pytest.mark.parametrize("close_time", CLOSE_TIMES)
+@pytest.mark.parametrize("mark_to_market", [False, True])
+def test_backtest_parity(market, agent, close_time, mark_to_market):
+    check_backtest_parity(market, AGENTS[agent], market.symbols, close_time=close_time,
+                          mark_to_market=mark_to_market)
+
+@pytest.mark.parametrize("agent", AGENTS)
+@pytest.mark.parametrize("mark_to_market", [False, True])
+def test_backtest_parity_low_cash(market, agent, mark_to_market):
+    # Enough for one or two of the stocks at a time
+    check_backtest_parity(market, AGENTS[agent], market.symbols, cash=250, close_time="14:15:00",
+                          mark_to_market=mark_to_market)
+
+@pytest.mark.parametrize("agent", AGENTS)
+def test_dict_market_mark_to_market(market, agent, tmp_path):
+    # The same prices through the pickled dictionary backend
+    data_file = tmp_path / "prices.pkl"
+    with open(data_file, "wb") as fh:
+        pickle.dump({day: market.data[day] for day in market.dates}, fh)
+    runs = []
+    for backend in (market, StockMarketDict(data_file=str(data_file))):
+        portfolio = Portfolio(cash=10000, mark_to_market=True)
+        executor = Executor(AGENTS[agent](market.symbols), backend, portfolio, market.symbols,
+                            time=True, close_time="14:15:00")
+        executor.run()
+        runs.append(executor)
+    array, mapping = runs
+    assert array.portfolio.trade_count == mapping.portfolio.trade_count
+    assert np.array_equal(array.portfolio_tracker.ticks, mapping.portfolio_tracker.ticks)
+    assert np.allclose(array.portfolio_tracker.equity, mapping.portfolio_tracker.equity, rtol=0, atol=1e-9)
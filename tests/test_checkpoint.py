@@ -0,0 +1,92 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from agent import AgentMACD, AgentMeanReversion, AgentRandom, AgentWaveTrend
+from checkpoint import Checkpoint, resume
+from main import Executor
+from portfolio import Portfolio
+
+AGENTS = {
+    "macd": lambda stocks: AgentMACD(stocks=stocks),
+    "wave": lambda stocks: AgentWaveTrend(stocks=stocks, window_size=10, selection_index=0),
+    "mean_reversion": lambda stocks: AgentMeanReversion(stocks=stocks),
+    "random": lambda stocks: AgentRandom(stocks=stocks, seed=3),
+}
+
+RECORDING = {
+    "every_tick": {},
+    "every_third": {"record_every": 3},
+    "session_close": {"record_session_close": True},
+}
+
+CRASH_TICK = 233
+
+class Crash(Exception):
+    pass
+
+class CrashingCheckpoint(Checkpoint):
+    """ Dies on a tick between two checkpoints
+    """
+
+    def due(self, t):
+        if (t == CRASH_TICK):
+            raise Crash()
+        return super().due(t)
+
+def executor(market, agent, recording):
+    # Random prices draw from the global random stream, which the checkpoint keeps
+    market.random_price = (agent == "random")
+    portfolio = Portfolio(cash=10000, mark_to_market=(agent != "macd"))
+    return Executor(AGENTS[agent](market.symbols), market, portfolio, market.symbols, time=True,
+                    close_time="14:15:00", **RECORDING[recording])
+
+def state(executor):
+    portfolio, decisions = executor.portfolio, executor.decision_tracker
+    return (portfolio.records.tolist(), [str(h) for h in portfolio.active], portfolio.cash,
+            {name: column.tolist() for name, column in executor.portfolio_tracker.columns().items()},
+            [column[:len(decisions)].tolist() for column in decisions.columns().values()], decisions.symbols,
+            str(executor.metrics.summary()))
+
+def crash_and_resume(market, agent, recording, directory, torn=False):
+    random.seed(7)
+    crashed = executor(market, agent, recording)
+    with pytest.raises(Crash):
+        crashed.run(checkpoint=CrashingCheckpoint(directory, every=50))
+    if torn:
+        # A crash while appending leaves rows past those counted in state.pkl
+        for name in os.listdir(directory):
+            if name.endswith(".bin"):
+                with open(os.path.join(directory, name), "ab") as fh:
+                    fh.write(b"torn row" * 5)
+    random.seed(999)
+    return resume(directory, market)
+
+@pytest.mark.parametrize("agent", AGENTS)
+@pytest.mark.parametrize("recording", RECORDING)
+def test_resume_after_crash(market, agent, recording, tmp_path):
+    random.seed(7)
+    finished = executor(market, agent, recording)
+    finished.run()
+    assert finished.portfolio.trade_count > 0, "Fixture needs to trade"
+
+    resumed = crash_and_resume(market, agent, recording, str(tmp_path))
+    assert state(resumed) == state(finished)
+
+@pytest.mark.parametrize("agent", ["macd", "random"])
+def test_resume_torn_columns(market, agent, tmp_path):
+    random.seed(7)
+    finished = executor(market, agent, "every_tick")
+    finished.run()
+
+    resumed = crash_and_resume(market, agent, "every_tick", str(tmp_path), torn=True)
+    assert state(resumed) == state(finished)
+
+def test_resume_other_market(market, tmp_path):
+    crashed = executor(market, "macd", "every_tick")
+    with pytest.raises(Crash):
+        crashed.run(checkpoint=CrashingCheckpoint(str(tmp_path), every=50))
+    with pytest.raises(AssertionError):
+        resume(str(tmp_path), market.slice(0, 100))
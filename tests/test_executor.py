@@ -0,0 +1,22 @@
+import numpy as np
+
+from agent import AgentWaveTrend
+from main import Executor
+from portfolio import Portfolio
+from utils import seconds_of_day
+
+def test_wave_trend_starts_sessions_afresh(market):
+    # Windows are cleared at the close and again when the next session
+    # starts, so the ticks after the close never fill them
+    window = 10
+    agent = AgentWaveTrend(stocks=market.symbols, window_size=window, selection_index=0)
+    executor = Executor(agent, market, Portfolio(cash=10000), market.symbols, time=True, close_time="14:15:00")
+    executor.run()
+
+    ticks = executor.decision_tracker.ticks
+    assert len(ticks) > 0, "Agent never decided"
+    sessions = market.session_date[ticks]
+    first = ticks[np.flatnonzero(np.append(True, sessions[1:] != sessions[:-1]))]
+    assert len(first) == len(np.unique(market.session_date))
+    session_start = seconds_of_day("13:30:00")
+    assert (market.time_of_day[first] >= session_start + 60 * window).all()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from indicators import SMA, RollingStd, TrendSlope
+
+def reference(indicator, prices, stat):
+    """ stat of the last n prices of each symbol at every tick it has a price
+    """
+    out = np.full(prices.shape, np.nan)
+    for s in range(prices.shape[1]):
+        seen = []
+        for t in range(prices.shape[0]):
+            if not np.isnan(prices[t, s]):
+                seen.append(prices[t, s])
+                if (len(seen) >= indicator.n):
+                    out[t, s] = stat(np.array(seen[-indicator.n:]))
+    return out
+
+def old_trend(half):
+    # How AgentMeanReversion worked out the trend before the indicators
+    return lambda window: (np.mean(window[half:]) - np.mean(window[:half])) / np.mean(window[half:])
+
+CASES = {
+    "sma": (lambda: SMA(12, resync_every=7), np.mean),
+    "std": (lambda: RollingStd(12, resync_every=7), np.std),
+    "trend": (lambda: TrendSlope(12, resync_every=7), old_trend(6)),
+    "trend_uneven": (lambda: TrendSlope(11, half=3, resync_every=5), old_trend(3)),
+}
+
+@pytest.mark.parametrize("case", CASES)
+def test_streaming_matches_batch_and_plain_numpy(case):
+    make, stat = CASES[case]
+    rng = np.random.default_rng(4)
+    # Large prices with small moves, where running sums lose precision first
+    prices = 5000 * np.cumprod(1 + 0.001 * rng.standard_normal((400, 5)), axis=0)
+    prices[rng.random(prices.shape) < 0.2] = np.nan
+    prices[:, 4] = np.nan
+    prices[::3, 4] = 7.0
+
+    expected = reference(make(), prices, stat)
+    indicator = make()
+    streamed = np.array([indicator.update(row) for row in prices])
+    computed = make().compute(prices)
+    assert indicator.ticks > 10 * indicator.resync_every
+    assert np.allclose(streamed, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+    assert np.allclose(computed, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+    assert np.array_equal(np.isnan(streamed), np.isnan(expected))
+
+def test_clear_forgets_prices():
+    indicator = RollingStd(3)
+    for x in [1.0, 2.0, 3.0]:
+        indicator.update([x])
+    indicator.clear()
+    assert np.isnan(indicator.update([4.0])).all()
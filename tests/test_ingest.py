@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+import store
+from scraping.data_transforms import arrays_to_blocks, read_price_csv
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def test_read_marketwatch_epoch_milliseconds():
+    stock, times, values = read_price_csv(os.path.join(DATA, "AMZN_intra_1min_08_03_20.csv"))
+    assert stock == "AMZN"
+    # The row without an open is dropped, every other minute is kept
+    minutes = [m for m in range(10) if m != 4]
+    assert times.tolist() == [store.to_epoch("2020-08-03T13:30:00") + 60 * m for m in minutes]
+    assert values[:, store.FIELDS.index("open")].tolist() == [100.0 + m for m in minutes]
+    assert np.isnan(values[minutes.index(6), store.FIELDS.index("volume")])
+
+    blocks = list(arrays_to_blocks([(stock, times, values)], partition="day"))
+    assert [key for key, _, _, _ in blocks] == ["2020-08-03"]
+    assert len(blocks[0][1]) == len(minutes)
+
+def test_read_daily_dates():
+    stock, times, values = read_price_csv(os.path.join(DATA, "FB_daily.csv"))
+    assert stock == "FB"
+    assert times.tolist() == store.to_epoch(["2020-08-03", "2020-08-04"]).tolist()
+    assert values[:, store.FIELDS.index("close")].tolist() == [251.0, 252.5]
+
+def test_blocks_later_files_win():
+    day = store.to_epoch("2020-08-03T13:30:00")
+    first = ("AMZN", day + 60 * np.arange(3), np.full((3, len(store.FIELDS)), 1.0))
+    # Overlaps the last minute of first and runs into the next day
+    second = ("AMZN", np.array([day + 120, day + 86400]), np.full((2, len(store.FIELDS)), 2.0))
+    other = ("FB", np.array([day + 60]), np.full((1, len(store.FIELDS)), 3.0))
+    blocks = list(arrays_to_blocks([first, second, other], partition="day"))
+    assert [key for key, _, _, _ in blocks] == ["2020-08-03", "2020-08-04"]
+    key, times, symbols, block = blocks[0]
+    assert symbols == ["AMZN", "FB"]
+    assert times.tolist() == (day + 60 * np.arange(3)).tolist()
+    assert block[:, 0, 0].tolist() == [1.0, 1.0, 2.0]
+    assert np.isnan(block[[0, 2], 1]).all() and block[1, 1, 0] == 3.0
+    assert blocks[1][3][0, 0, 0] == 2.0 and np.isnan(blocks[1][3][0, 1]).all()
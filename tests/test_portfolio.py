@@ -0,0 +1,15 @@
+from portfolio import Portfolio
+
+def test_ledger_dates_fills_by_tick():
+    portfolio = Portfolio(cash=1000)
+    portfolio.add("AMZN", 100.0, 3, 2)
+    portfolio.add("AMZN", 110.0, 5, 1)
+    portfolio.sold("AMZN", 120.0, 8, 2)
+    assert portfolio.records[["buy_tick", "sell_tick"]].tolist() == [(3, 8)]
+    assert [(a.buy_date, a.quantity) for a in portfolio.active] == [(5, 1)]
+
+    portfolio.dates = [f"2020-08-03 13:3{i}:00" for i in range(10)]
+    trade = portfolio.historical[0]
+    assert (trade.buy_date, trade.sell_date, trade.profit) == ("2020-08-03 13:33:00", "2020-08-03 13:38:00", 20.0)
+    assert portfolio.active[0].buy_date == "2020-08-03 13:35:00"
+    assert portfolio.cash == 1000 - 310.0 + 240.0
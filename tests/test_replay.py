@@ -0,0 +1,15 @@
+import pytest
+
+from agent import AgentMACD, AgentMeanReversion, AgentRandom
+from parity import check_replay_parity
+
+AGENTS = {
+    "macd": lambda stocks: AgentMACD(stocks=stocks),
+    "mean_reversion": lambda stocks: AgentMeanReversion(stocks=stocks),
+    "random": lambda stocks: AgentRandom(stocks=stocks, seed=3),
+}
+
+@pytest.mark.parametrize("agent", AGENTS)
+@pytest.mark.parametrize("cash", [10000, 250])
+def test_replay_parity(market, agent, cash):
+    check_replay_parity(market, AGENTS[agent], market.symbols, cash=cash)
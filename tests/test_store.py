@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+import store
+
+SYMBOLS = ["AMZN", "FB"]
+
+@pytest.fixture
+def root(tmp_path):
+    """ Store of two days, 5 minutes a day, partitioned by day
+    """
+    times = store.to_epoch(["2020-08-03T13:30:00", "2020-08-04T13:30:00"])[:, None] + 60 * np.arange(5)
+    prices = np.arange(10 * len(SYMBOLS) * len(store.FIELDS), dtype=np.float64).reshape(10, len(SYMBOLS), -1)
+    store.write_store(str(tmp_path), times.ravel(), SYMBOLS, prices, partition="day")
+    return str(tmp_path)
+
+def read(root):
+    dates, symbols, prices = store.open_store(root)
+    return dates, symbols, prices
+
+def directories(root):
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+def test_overlapping_append_is_a_no_op(root):
+    dates, symbols, prices = read(root)
+    before, listing = store.read_meta(root), directories(root)
+    meta = store.append_store(root, dates[2:7], symbols, prices[2:7])
+    assert meta == before
+    assert store.read_meta(root) == before
+    assert directories(root) == listing
+
+def test_append_new_symbols_and_partitions(root):
+    dates, symbols, prices = read(root)
+    new_dates = [dates[1], "2020-08-05 13:30:00"]
+    new_prices = np.full((2, 1, len(store.FIELDS)), 7.0)
+    meta = store.append_store(root, new_dates, ["T"], new_prices)
+    assert meta["symbols"] == SYMBOLS + ["T"]
+    assert [info["key"] for info in meta["partitions"]] == ["2020-08-03", "2020-08-04", "2020-08-05"]
+
+    merged_dates, merged_symbols, merged = read(root)
+    assert merged_dates == dates + ["2020-08-05 13:30:00"]
+    assert merged_symbols == SYMBOLS + ["T"]
+    assert np.array_equal(merged[:len(dates), :2], prices)
+    assert np.isnan(merged[len(dates), :2]).all()
+    t = merged_symbols.index("T")
+    assert (merged[[1, len(dates)], t] == 7.0).all()
+    assert np.isnan(np.delete(merged[:, t], [1, len(dates)], axis=0)).all()
+
+def test_append_keeps_old_generation_for_open_readers(root):
+    dates, symbols, prices = read(root)
+    # A reader that has read meta.json but not the partitions yet
+    opened = store.read_meta(root)
+    changed = prices[:2].copy()
+    changed[:, 0] += 1000
+    meta = store.append_store(root, dates[:2], symbols, changed)
+
+    old = {info["key"]: info["path"] for info in opened["partitions"]}
+    new = {info["key"]: info["path"] for info in meta["partitions"]}
+    assert new["2020-08-03"] != old["2020-08-03"]
+    assert new["2020-08-04"] == old["2020-08-04"]
+    old_prices = np.load(os.path.join(root, old["2020-08-03"], "prices.npy"), mmap_mode="r")
+    assert np.array_equal(np.asarray(old_prices).transpose(1, 0, 2), prices[:5])
+
+    _, _, merged = read(root)
+    assert np.array_equal(merged[:2], changed)
+    assert np.array_equal(merged[2:], prices[2:])
+
+    del old_prices
+    assert store.vacuum(root) == [old["2020-08-03"]]
+    assert directories(root) == sorted(new.values())
+    _, _, vacuumed = read(root)
+    assert np.array_equal(vacuumed, merged)
@@ -0,0 +1,17 @@
+import pickle
+
+import numpy as np
+
+from sweep import SharedMarket
+
+def test_shared_market_attach(market):
+    market.random_price = True
+    market.set_stocks(market.symbols[:2])
+    with SharedMarket(market) as shared:
+        attached = pickle.loads(pickle.dumps(shared)).attach(5, 100)
+        assert attached.dates == market.dates[5:100]
+        assert np.array_equal(attached.times, market.times[5:100])
+        assert np.array_equal(attached.prices, market.prices[5:100], equal_nan=True)
+        assert attached.random_price
+        assert attached.stocks == market.symbols[:2]
+        attached.shared_memory.close()
@@ -0,0 +1,36 @@
+import numpy as np
+
+from agent import AgentMACD
+from backtest import run_backtest
+from main import Executor
+from portfolio import Portfolio
+from sweep import backtest_agent, param_grid
+from walkforward import walk_forward, walk_forward_windows
+
+GRID = param_grid(mac1_num=[10, 20], mac2_num=[5], macd_num=[4])
+
+def test_gain_counts_last_session(market):
+    # The gain is the value after the last fills, not the last tracked tick
+    row = backtest_agent(market, AgentMACD, GRID[0], close_time="14:15:00")
+    result = run_backtest(AgentMACD(stocks=market.symbols, **GRID[0]).compute_signals(market), market,
+                          close_time="14:15:00")
+    assert row["gain"] == result.gain[-1]
+    executor = Executor(AgentMACD(stocks=market.symbols, **GRID[0]), market, Portfolio(cash=10000),
+                        market.symbols, time=True, close_time="14:15:00")
+    executor.run()
+    assert np.isclose(row["gain"], executor.portfolio.total_gain, rtol=0, atol=1e-9)
+
+def test_walk_forward_windows_trade(market):
+    windows = walk_forward_windows(market.session_date, 2, 1)
+    frame = walk_forward(market, AgentMACD, GRID, train_sessions=2, test_sessions=1,
+                         close_time="14:15:00", processes=1)
+    assert len(frame) == len(windows)
+    traded = frame[frame["test_trades"] > 0]
+    assert len(traded) > 0, "Fixture needs a test window that trades"
+    for window, (_, row) in zip(windows, frame.iterrows()):
+        test = market.slice(window[2], window[3])
+        params = {name: row[name] for name in GRID[0]}
+        result = run_backtest(AgentMACD(stocks=market.symbols, **params).compute_signals(test), test,
+                              close_time="14:15:00")
+        assert row["test_gain"] == result.gain[-1]
+    assert (traded["test_gain"] != 0).any()
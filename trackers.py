@@ -0,0 +1,211 @@
+"""
+Preallocated columns of what happens during a backtest, kept as typed
+arrays instead of a Python object per tick.
+"""
+import numpy as np
+
+from agent import BUY, SELL, HOLD
+from metrics import summary
+
+class DecisionTracker:
+    """
+    BUY and SELL decisions of a backtest kept in preallocated columns,
+    one entry per decision. Columns double in size when they fill up.
+        ticks: index into market.dates of each decision
+        symbol_rows: index into symbols of the stock decided on
+        actions: BUY or SELL
+        variables: (entries x len(names)) decision variables, NaN when not given
+    """
+
+    def __init__(self, names=(), capacity=1024):
+        self.names = tuple(names)
+        self.symbols = []
+        self.index = {}
+        self.size = 0
+        self._ticks = np.zeros(capacity, dtype=np.int64)
+        self._symbol_rows = np.zeros(capacity, dtype=np.int32)
+        self._actions = np.zeros(capacity, dtype=np.int8)
+        self._variables = np.full((capacity, len(self.names)), np.nan)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def ticks(self):
+        return self._ticks[:self.size]
+
+    @property
+    def symbol_rows(self):
+        return self._symbol_rows[:self.size]
+
+    @property
+    def actions(self):
+        return self._actions[:self.size]
+
+    @property
+    def variables(self):
+        return self._variables[:self.size]
+
+    def _grow(self, needed):
+        capacity = max(2*len(self._ticks), needed)
+        extra = capacity - len(self._ticks)
+        self._ticks = np.concatenate([self._ticks, np.zeros(extra, dtype=np.int64)])
+        self._symbol_rows = np.concatenate([self._symbol_rows, np.zeros(extra, dtype=np.int32)])
+        self._actions = np.concatenate([self._actions, np.zeros(extra, dtype=np.int8)])
+        self._variables = np.concatenate([self._variables, np.full((extra, len(self.names)), np.nan)])
+
+    def symbol_row(self, symbol):
+        row = self.index.get(symbol)
+        if (row == None):
+            row = len(self.symbols)
+            self.symbols.append(symbol)
+            self.index[symbol] = row
+        return row
+
+    def record(self, t, decisions):
+        """ Add the BUY and SELL decisions of tick t
+        """
+        rows = decisions.rows()
+        if (len(rows) == 0):
+            return
+        start, end = self.size, self.size + len(rows)
+        if (end > len(self._ticks)):
+            self._grow(end)
+        self._ticks[start:end] = t
+        self._symbol_rows[start:end] = [self.symbol_row(decisions.symbols[i]) for i in rows]
+        self._actions[start:end] = decisions.actions[rows]
+        if (decisions.variables is not None):
+            for j, name in enumerate(decisions.names):
+                if name in self.names:
+                    self._variables[start:end, self.names.index(name)] = decisions.variables[rows, j]
+        self.size = end
+
+    def columns(self):
+        """ The preallocated columns by name, rows from size on are unused
+        """
+        return {"ticks": self._ticks, "symbol_rows": self._symbol_rows, "actions": self._actions,
+                "variables": self._variables}
+
+    def rows(self, symbol):
+        """ Entries of the decisions made for symbol
+        """
+        row = self.index.get(symbol)
+        if (row == None):
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.symbol_rows == row)
+
+    def column(self, name):
+        """ Decision variable name of every entry
+        """
+        return self.variables[:, self.names.index(name)]
+
+class PortfolioTracker:
+    """
+    Portfolio value, cash, exposure, gain and decision code of the ticks
+    Executor tracks, in columns preallocated from the number of ticks.
+        ticks: index into market.dates of each entry
+        equity: portfolio value
+        cash: cash left
+        exposure: value of the stocks held, equity - cash
+        gain: percent gain on the initial cash
+        actions: BUY if anything was bought on the tick, SELL if only sold, otherwise HOLD
+
+    Long runs can be recorded sparsely
+        every: only keep every Nth tracked tick
+        session_close: only keep the last tracked tick of each session
+    """
+
+    def __init__(self, times, every=1, session_close=False):
+        assert every > 0, "Must record at least every tick"
+        self.all_times = times
+        self.every = every
+        self.session_close = session_close
+        if (session_close):
+            self.session_date = times // 86400
+            capacity = len(np.unique(self.session_date))
+        else:
+            capacity = -(-len(times) // every)
+        self.size = 0
+        self.seen = 0
+        self.last_session = None
+        self._ticks = np.zeros(capacity, dtype=np.int64)
+        self._equity = np.zeros(capacity)
+        self._cash = np.zeros(capacity)
+        self._gain = np.zeros(capacity)
+        self._actions = np.zeros(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def ticks(self):
+        return self._ticks[:self.size]
+
+    @property
+    def equity(self):
+        return self._equity[:self.size]
+
+    @property
+    def cash(self):
+        return self._cash[:self.size]
+
+    @property
+    def exposure(self):
+        return self.equity - self.cash
+
+    @property
+    def gain(self):
+        return self._gain[:self.size]
+
+    @property
+    def actions(self):
+        return self._actions[:self.size]
+
+    @property
+    def times(self):
+        """ Seconds since epoch of each entry
+        """
+        return self.all_times[self.ticks]
+
+    def record(self, t, equity, cash, gain, decisions=None):
+        """ Values of tracked tick t and the Decisions made on it
+        """
+        self.seen += 1
+        if (self.session_close):
+            session = self.session_date[t]
+            if (session == self.last_session):
+                row = self.size - 1
+            else:
+                row = self.size
+                self.size += 1
+                self.last_session = session
+        elif ((self.seen - 1) % self.every == 0):
+            row = self.size
+            self.size += 1
+        else:
+            return
+
+        action = HOLD
+        if (decisions != None) and (len(decisions) > 0):
+            action = BUY if (decisions.actions == BUY).any() else SELL
+        self._ticks[row] = t
+        self._equity[row] = equity
+        self._cash[row] = cash
+        self._gain[row] = gain
+        self._actions[row] = action
+
+    def columns(self):
+        """ The preallocated columns by name, rows from size on are unused
+        """
+        return {"ticks": self._ticks, "equity": self._equity, "cash": self._cash, "gain": self._gain,
+                "actions": self._actions}
+
+    def value_tracker(self, dates):
+        """ {day: gain} of the entries
+        """
+        return dict(zip([dates[t] for t in self.ticks.tolist()], self.gain.tolist()))
+
+    def metrics(self, profits=(), traded=(), periods_per_year=252, risk_free=0.0):
+        """ metrics.summary of the recorded values
+        """
+        return summary(self.equity, self.times, profits, traded, periods_per_year, risk_free)
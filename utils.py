@@ -21,4 +21,8 @@ def split_datetime_str(date_str):
     time = tmp[1]
     return date, time
 
-
+def seconds_of_day(time_str):
+    """ "HH:MM:SS" to seconds since midnight
+    """
+    hours, minutes, seconds = map(int, time_str.split(":"))
+    return 3600*hours + 60*minutes + seconds
@@ -0,0 +1,104 @@
+"""
+Walk forward optimization. The timeline is cut into windows of
+train_sessions sessions followed by test_sessions sessions, moving
+step_sessions sessions at a time. On each window every params dict of a
+grid is backtested on the train part, the best one is then backtested on
+the test part that follows it.
+
+Windows run in parallel over a process pool sharing the market's prices
+(sweep.SharedMarket). Train and test parts are StockMarketArray.slice
+views of the prices, nothing is reloaded or copied. Each part is
+backtested on its own, so agents start with empty windows at its first tick.
+"""
+import time
+from multiprocessing import Pool
+
+import pandas as pd
+
+from backtest import sessions
+import sweep
+from market import StockMarketArray
+from sweep import SharedMarket, _init_worker, backtest_agent
+
+def walk_forward_windows(session_date, train_sessions, test_sessions, step_sessions=None):
+    """
+    Tick ranges of the windows as (train_start, train_end, test_start, test_end),
+    ends not included. step_sessions defaults to test_sessions so the
+    test parts follow each other without overlapping
+    """
+    assert train_sessions > 0 and test_sessions > 0, "Train and test need at least a session each"
+    if (step_sessions == None):
+        step_sessions = test_sessions
+    _, first = sessions(session_date)
+    bounds = [int(b) for b in first] + [len(session_date)]
+    windows = []
+    start = 0
+    while (start + train_sessions + test_sessions < len(bounds)):
+        split = start + train_sessions
+        end = split + test_sessions
+        windows.append((bounds[start], bounds[split], bounds[split], bounds[end]))
+        start += step_sessions
+    return windows
+
+def optimize_window(market, agent_class, grid, window, stocks=None, cash=10000, close_time="18:30:00",
+                    metric="gain"):
+    """
+    Pick the params of grid with the best metric on the train part of
+    window and backtest them on the test part
+
+    Returns:
+        dict of the window dates, best params and train and test results
+    """
+    train_start, train_end, test_start, test_end = window
+    train = market.slice(train_start, train_end)
+    runs = [backtest_agent(train, agent_class, params, stocks, cash, close_time) for params in grid]
+    best = max(range(len(grid)), key=lambda i: runs[i][metric])
+    test = backtest_agent(market.slice(test_start, test_end), agent_class, grid[best], stocks, cash, close_time)
+
+    result = {"train_start": market.dates[train_start], "test_start": market.dates[test_start],
+              "test_end": market.dates[test_end - 1]}
+    result.update(grid[best])
+    result.update({"train_" + metric: runs[best][metric]})
+    result.update({"test_" + k: v for k, v in test.items() if k not in grid[best]})
+    return result
+
+def _optimize_window(args):
+    # Market the worker attached to in sweep._init_worker
+    return optimize_window(sweep._market, *args)
+
+def walk_forward(market, agent_class, grid, train_sessions=20, test_sessions=5, step_sessions=None,
+                 stocks=None, cash=10000, close_time="18:30:00", metric="gain", processes=None):
+    """
+    Walk forward agent_class over market with the params dicts of grid
+    (see sweep.param_grid), picking the params with the largest metric
+    on each train part. Windows are spread over processes.
+
+    Returns:
+        DataFrame with a row per window in time order
+    """
+    if not isinstance(market, StockMarketArray):
+        market = StockMarketArray.from_dict(market.data)
+    windows = walk_forward_windows(market.session_date, train_sessions, test_sessions, step_sessions)
+    jobs = [(agent_class, grid, window, stocks, cash, close_time, metric) for window in windows]
+    rows = []
+    start = time.perf_counter()
+    if (processes == 1):
+        results = (optimize_window(market, *job) for job in jobs)
+        shared = None
+    else:
+        shared = SharedMarket(market)
+        workers = Pool(processes, initializer=_init_worker, initargs=(shared,))
+        results = workers.imap(_optimize_window, jobs)
+
+    try:
+        for row in results:
+            rows.append(row)
+            print(f"Test {row['test_start']} to {row['test_end']}: "
+                  f"train {metric} {row['train_' + metric]:.3f} test {metric} {row['test_' + metric]:.3f}")
+    finally:
+        if (shared != None):
+            workers.close()
+            workers.join()
+            shared.close()
+    print(f"Finished {len(rows)} {agent_class.__name__} windows in {time.perf_counter() - start:.1f}s")
+    return pd.DataFrame(rows)
@@ -50,3 +50,14 @@ def lowpassfilter(signal, threshold = 0.63, wavelet="db4"):
     coeff[1:] = (pywt.threshold(i, value=threshold, mode="soft" ) for i in coeff[1:])
     reconstructed_signal = pywt.waverec(coeff, wavelet, mode="per" )
     return reconstructed_signal
+
+def lowpassfilter_batch(signals, threshold = 0.63, wavelet="db4"):
+    """ lowpassfilter applied to every row of a (signals x samples) matrix
+        with one transform along the last axis. Each row is thresholded
+        by threshold times its own nanmax, same as lowpassfilter.
+    """
+    threshold = threshold*np.nanmax(signals, axis=-1, keepdims=True)
+    coeff = pywt.wavedec(signals, wavelet, mode="per", axis=-1)
+    coeff[1:] = (pywt.threshold(i, value=threshold, mode="soft" ) for i in coeff[1:])
+    reconstructed_signal = pywt.waverec(coeff, wavelet, mode="per", axis=-1)
+    return reconstructed_signal